@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+
+"""
+Ahead of time compiler
+
+Translates a fixed LS-8 program into a Python module, so it starts running
+compiled code straight away instead of warming up the JIT:
+
+    python aot.py programs/call.ls8 call_ls8.py
+    python emulator.py call_ls8.py
+
+The image is disassembled with the assembler's opcode table (asm.py OPCODES)
+and the control flow graph is followed from the entry point. Jump and call
+targets are known when the register was loaded with LDI in the same block,
+as are interrupt handlers stored into the vector table that way. Every basic
+block found becomes a function like the ones the JIT compiles: registers live
+in locals and jumps to known targets return the target address as a constant.
+
+install() in the generated module loads the program and puts its blocks in
+the CPU's JIT table. Everything the compiler couldn't see runs on the
+interpreter (and JIT) as usual: computed jumps to addresses it found no block
+for, and code overwritten at run time, which drops the compiled blocks built
+from it.
+"""
+
+import argparse
+import importlib.util
+import sys
+from os import path
+
+import image
+from cpu import CPU, JIT_MAX_BLOCK, WRITES_REGISTER_A
+
+# Mnemonics that end a basic block
+CONDITIONAL_JUMPS = {"JEQ", "JNE", "JGT", "JLT", "JGE", "JLE"}
+BLOCK_ENDS = CONDITIONAL_JUMPS | {"JMP", "CALL", "INT", "RET", "IRET", "HLT"}
+
+# Interrupt vector table
+IVT_ADDRESS = 0xF8
+
+
+def opcode_table():
+    """
+    Returns {opcode: (mnemonic, operand type)} from the assembler's OPCODES
+    """
+    asm = image.assembler()
+    return {
+        int(info["code"], 2): (name, info["type"]) for name, info in asm.OPCODES.items()
+    }
+
+
+def disassemble(ram, address, table):
+    """
+    Decodes the instruction at address
+
+    Returns (mnemonic, operands, length), None for bytes that aren't an
+    instruction. Length follows the CPU, which takes it from the opcode.
+    """
+    opcode = ram[address]
+    if opcode not in table:
+        return None
+
+    name, kind = table[opcode]
+    operands = tuple(ram[(address + 1 + i) & 0xFF] for i in range(min(kind, 2)))
+
+    return name, operands, (opcode >> 6) + 1
+
+
+def format_instruction(name, operands):
+    """
+    Renders a decoded instruction in assembler syntax
+    """
+    if name in ("LDI", "ADDI"):
+        return f"{name} R{operands[0]},0x{operands[1]:02X}"
+    return f"{name} {','.join(f'R{r}' for r in operands)}".rstrip()
+
+
+def find_blocks(ram, entry_point):
+    """
+    Follows the control flow graph from entry_point
+
+    Returns {start: (instructions, successors)} for every basic block that can
+    be reached through known targets, instructions being (address, mnemonic,
+    operands) tuples.
+    """
+    table = opcode_table()
+    blocks = {}
+    work = [entry_point]
+
+    while work:
+        start = work.pop()
+        if start in blocks or start >= len(ram):
+            continue
+
+        instructions = []
+        successors = []
+        # Registers holding a constant loaded in this block
+        known = {}
+        address = start
+
+        while address < len(ram) and len(instructions) < JIT_MAX_BLOCK:
+            decoded = disassemble(ram, address, table)
+            if decoded is None:
+                # Faults at run time
+                break
+
+            name, operands, length = decoded
+            instructions.append((address, name, operands))
+            next_address = address + length
+            target = known.get(operands[0]) if operands else None
+
+            if ram[address] in WRITES_REGISTER_A:
+                known.pop(operands[0], None)
+            if name == "LDI":
+                known[operands[0]] = operands[1]
+            elif name == "ST":
+                vector = known.get(operands[0])
+                if vector is not None and vector >= IVT_ADDRESS and operands[1] in known:
+                    successors.append(known[operands[1]])
+
+            if name in BLOCK_ENDS:
+                if target is not None and name != "INT":
+                    successors.append(target)
+                if name not in ("JMP", "RET", "IRET", "HLT"):
+                    # Conditional fallthrough, or where CALL / INT return to
+                    successors.append(next_address)
+                break
+
+            address = next_address
+        else:
+            # Block size limit, carry on in a new block
+            successors.append(address)
+
+        blocks[start] = (instructions, successors)
+        work.extend(successors)
+
+    return blocks
+
+
+def compile_program(input_file):
+    """
+    Returns the source of a module running input_file ahead of time compiled
+    """
+    ram = bytearray(256)
+    load_address, entry_point, size = image.load_program(input_file, ram)
+    program = bytes(ram[load_address : load_address + size])
+
+    ls8 = CPU()
+    ls8.load_bytes(program, load_address, entry_point)
+
+    handlers = {}
+    functions = []
+    entries = []
+
+    for start, (instructions, successors) in sorted(find_blocks(ls8.ram, entry_point).items()):
+        generated = ls8._jit_source(start)
+        if generated is None:
+            continue
+
+        name, source, block_handlers, length, end = generated
+        handlers.update(block_handlers)
+
+        listing = [f"#   {address:02X}: {format_instruction(*rest)}" for address, *rest in instructions]
+        if successors:
+            listing.append("#   -> " + ", ".join(f"0x{target:02X}" for target in successors))
+
+        functions.append("\n".join(listing + [source, f"{name}.length = {length}", "", ""]))
+        entries.append(f"    0x{start:02X}: ({name}, 0x{end:02X}),")
+
+    hex_lines = [program[i : i + 32].hex() for i in range(0, len(program), 32)] or [""]
+
+    lines = [
+        '"""',
+        f"{path.basename(input_file)} compiled ahead of time by aot.py, regenerate instead of editing",
+        '"""',
+        "",
+        "from cpu import CPU",
+        "",
+        "IMAGE = bytes.fromhex(",
+        *[f'    "{line}"' for line in hex_lines],
+        ")",
+        f"LOAD_ADDRESS = 0x{load_address:02X}",
+        f"ENTRY_POINT = 0x{entry_point:02X}",
+        "",
+        "# Handlers for instructions the blocks don't inline",
+        *[
+            f"{name} = CPU._jit_handler(0x{instruction:02X}, {wrapped})"
+            for name, (instruction, wrapped) in sorted(handlers.items())
+        ],
+        "",
+        "",
+        *functions,
+        "# start: (block, end of the code it was compiled from)",
+        "BLOCKS = {",
+        *entries,
+        "}",
+        "",
+        "",
+        "def install(cpu):",
+        '    """',
+        "    Loads the program into cpu along with its compiled blocks",
+        '    """',
+        "    cpu.load_bytes(IMAGE, LOAD_ADDRESS, ENTRY_POINT)",
+        "    cpu.install_blocks(BLOCKS)",
+        "",
+    ]
+
+    return "\n".join(lines)
+
+
+def load_compiled(module_file):
+    """
+    Imports a module generated by compile_program
+    """
+    name = path.splitext(path.basename(module_file))[0]
+    spec = importlib.util.spec_from_file_location(name, module_file)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    if not hasattr(module, "install"):
+        raise ValueError(f"{module_file}: not a compiled LS-8 program")
+
+    return module
+
+
+def parse_args():
+    """
+    Parses command line arguments
+    """
+    parser = argparse.ArgumentParser(prog="aot.py", description="LS-8 ahead of time compiler")
+    parser.add_argument("input_file", help="program to compile (.ls8, .ls8b image or .asm source)")
+    parser.add_argument("output_file", nargs="?", help="module to write (default: input_file.py)")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    try:
+        source = compile_program(args.input_file)
+    except (OSError, ValueError) as error:
+        print(error, file=sys.stderr)
+        sys.exit(2)
+
+    output_file = args.output_file or args.input_file + ".py"
+    with open(output_file, "w") as module_file:
+        module_file.write(source)
+
+    print(f"{args.input_file} -> {output_file}")
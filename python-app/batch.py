@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+"""
+Batch runner
+
+Runs many LS-8 programs across a pool of worker processes.
+
+The manifest is a JSONL file, one job per line:
+
+    {"program": "programs/mult.ls8"}
+    {"program": "programs/keyboard.ls8", "input": "hello", "max_cycles": 50000}
+
+Relative program paths are resolved against the manifest's directory.
+"input" is typed on the keyboard one key at a time, "max_cycles" overrides
+the default cycle budget. Each worker keeps one CPU and resets it between
+jobs. Results are written as JSONL in manifest order.
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from cpu import CPU, EXIT_BUDGET
+from keyboard import ScriptedKeyboard
+from output import OutputDevice
+
+# Default cycle budget per job
+DEFAULT_MAX_CYCLES = 1_000_000
+
+# Timer period, in cycles, so runs are deterministic
+DEFAULT_TIMER_CYCLES = 10_000
+
+# Cycles between key presses while a job still has input to type
+KEY_INTERVAL = 1000
+
+# CPU reused by every job in a worker process
+_cpu = None
+
+
+def _init_worker(jit, timer_cycles):
+    """
+    Creates the CPU for this worker process
+    """
+    global _cpu
+    _cpu = CPU(
+        clock_hz=None, jit=jit, timer_cycles=timer_cycles, output=OutputDevice()
+    )
+
+
+def run_job(job):
+    """
+    Runs a single job on this worker's CPU, returns a result dict
+    """
+    cpu = _cpu
+    cpu.reset()
+
+    result = {
+        "program": job["program"],
+        "reason": None,
+        "fault": None,
+        "cycles": 0,
+        "elapsed": 0.0,
+        "output": "",
+    }
+
+    # Capture the job's output
+    output = io.StringIO()
+    cpu.output.sink = output
+
+    try:
+        cpu.load(job["path"])
+    except (OSError, ValueError) as error:
+        result["reason"] = "error"
+        result["fault"] = str(error)
+        return result
+
+    keyboard = ScriptedKeyboard(cpu, job.get("input", ""))
+    remaining = job["max_cycles"]
+
+    while True:
+        # Run in short slices while there are keys left to type
+        run = cpu.run(
+            max_cycles=min(KEY_INTERVAL, remaining) if keyboard.pending else remaining
+        )
+        remaining -= run.cycles
+        result["cycles"] += run.cycles
+        result["elapsed"] += run.elapsed
+
+        if run.reason != EXIT_BUDGET or remaining <= 0:
+            break
+
+        keyboard.poll()
+
+    result["reason"] = run.reason
+    result["fault"] = run.fault
+    result["output"] = output.getvalue()
+
+    return result
+
+
+def read_manifest(manifest_file, max_cycles):
+    """
+    Reads jobs from a JSONL manifest
+    """
+    base = os.path.dirname(os.path.abspath(manifest_file))
+    jobs = []
+
+    with open(manifest_file) as manifest:
+        for line_num, line in enumerate(manifest, 1):
+            line = line.strip()
+
+            # Ignore blank lines and comments
+            if not line or line[0] == "#":
+                continue
+
+            try:
+                job = json.loads(line)
+                program = job["program"]
+            except (ValueError, KeyError, TypeError):
+                print(f"line {line_num}: invalid job", file=sys.stderr)
+                sys.exit(2)
+
+            job["path"] = os.path.join(base, program)
+            job.setdefault("max_cycles", max_cycles)
+            jobs.append(job)
+
+    return jobs
+
+
+def parse_args():
+    """
+    Parses command line arguments
+    """
+    parser = argparse.ArgumentParser(prog="batch.py", description="LS-8 batch runner")
+    parser.add_argument("manifest", help="JSONL file with one job per line")
+    parser.add_argument(
+        "-o", "--output", default="-", help="JSONL results file (default stdout)"
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="worker processes (default: one per core)",
+    )
+    parser.add_argument(
+        "-n",
+        "--max-cycles",
+        type=int,
+        default=DEFAULT_MAX_CYCLES,
+        metavar="N",
+        help=f"default cycle budget per job (default {DEFAULT_MAX_CYCLES})",
+    )
+    parser.add_argument(
+        "--timer-cycles",
+        type=int,
+        default=DEFAULT_TIMER_CYCLES,
+        metavar="N",
+        help=f"fire the timer interrupt every N cycles (default {DEFAULT_TIMER_CYCLES})",
+    )
+    parser.add_argument(
+        "-j", "--jit", action="store_true", help="compile hot code into Python"
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    jobs = read_manifest(args.manifest, args.max_cycles)
+
+    results_file = sys.stdout if args.output == "-" else open(args.output, "w")
+
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=_init_worker,
+        initargs=(args.jit, args.timer_cycles),
+    ) as pool:
+        # Small chunks keep workers busy without a round trip per job
+        chunksize = max(1, len(jobs) // (args.workers * 4))
+        for result in pool.map(run_job, jobs, chunksize=chunksize):
+            results_file.write(json.dumps(result) + "\n")
+
+    if results_file is not sys.stdout:
+        results_file.close()
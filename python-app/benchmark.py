@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+"""
+Benchmark
+
+Runs LS-8 programs headless with their output captured and reports how fast
+the emulator executes them.
+
+Each program is run twice: once timed, and once under the profiler to
+collect the opcode mix. The timer interrupt is virtual so both runs execute exactly
+the same instructions.
+"""
+
+import argparse
+import glob
+import io
+import json
+import platform
+from os import path
+
+from cpu import CPU
+from output import OutputDevice
+from profiler import Profiler, opcode_name
+
+# Default instruction budget per program
+DEFAULT_MAX_INSTRUCTIONS = 1_000_000
+
+# Timer period used while benchmarking, in cycles
+BENCHMARK_TIMER_CYCLES = 10_000
+
+PROGRAMS_DIR = path.join(path.dirname(path.abspath(__file__)), "programs")
+
+
+def _new_cpu(program, jit, output):
+    """
+    Creates an unthrottled CPU with program loaded, printing to output
+
+    Idle loops are executed rather than skipped so programs waiting for
+    interrupts are measured like any other.
+    """
+    cpu = CPU(
+        clock_hz=None,
+        jit=jit,
+        timer_cycles=BENCHMARK_TIMER_CYCLES,
+        output=OutputDevice(output),
+        idle=False,
+    )
+    cpu.load(program)
+    return cpu
+
+
+def _timed_run(program, max_instructions, jit, output):
+    """
+    Runs program until HLT or the budget runs out, returns the RunResult
+    """
+    cpu = _new_cpu(program, jit, output)
+    return cpu.run(max_cycles=max_instructions)
+
+
+def _counted_run(program, max_instructions):
+    """
+    Profiles program to count how often each opcode executes
+    """
+    cpu = _new_cpu(program, jit=False, output=io.BytesIO())
+    cpu.profiler = Profiler()
+    cpu.run(max_cycles=max_instructions)
+
+    return cpu.profiler.opcodes
+
+
+def benchmark(program, max_instructions=DEFAULT_MAX_INSTRUCTIONS, jit=False):
+    """
+    Benchmarks a single program, returns a dict of results
+    """
+    # Guest output is captured so terminal I/O doesn't skew the timings
+    output = io.BytesIO()
+    try:
+        result = _timed_run(program, max_instructions, jit, output)
+        counts = _counted_run(program, max_instructions)
+        exit_reason = result.reason
+        if result.fault:
+            exit_reason += f": {result.fault}"
+    except (OSError, ValueError) as error:
+        # The program couldn't be loaded, faults while running are in result
+        result = None
+        counts = [0] * 256
+        exit_reason = f"error: {type(error).__name__}: {error}"
+
+    instructions = result.cycles if result else 0
+    elapsed = result.elapsed if result else 0.0
+
+    return {
+        "program": path.basename(program),
+        "exit": exit_reason,
+        "instructions": instructions,
+        "seconds": elapsed,
+        "ips": instructions / elapsed if elapsed else 0.0,
+        "opcodes": {
+            opcode_name(opcode): count
+            for opcode, count in sorted(
+                enumerate(counts), key=lambda item: item[1], reverse=True
+            )
+            if count
+        },
+        "output_bytes": len(output.getvalue()),
+    }
+
+
+def print_report(results):
+    """
+    Prints results as a table
+    """
+    print(
+        f"{'program':<20} {'exit':<8} {'instructions':>12} {'seconds':>9} {'ips':>12}  top opcodes"
+    )
+
+    for result in results:
+        top = ", ".join(
+            f"{name} {count}" for name, count in list(result["opcodes"].items())[:4]
+        )
+        print(
+            f"{result['program']:<20} {result['exit'].split(':')[0]:<8} "
+            f"{result['instructions']:>12} {result['seconds']:>9.4f} "
+            f"{result['ips']:>12,.0f}  {top}"
+        )
+
+    instructions = sum(result["instructions"] for result in results)
+    seconds = sum(result["seconds"] for result in results)
+    print(
+        f"{'total':<20} {'':<8} {instructions:>12} {seconds:>9.4f} "
+        f"{instructions / seconds if seconds else 0:>12,.0f}"
+    )
+
+
+def parse_args():
+    """
+    Parses command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        prog="benchmark.py", description="LS-8 emulator benchmark"
+    )
+    parser.add_argument(
+        "programs",
+        nargs="*",
+        help="programs to run (default: every .ls8 in programs/)",
+    )
+    parser.add_argument(
+        "-n",
+        "--max-instructions",
+        type=int,
+        default=DEFAULT_MAX_INSTRUCTIONS,
+        metavar="N",
+        help=f"stop each program after N instructions (default {DEFAULT_MAX_INSTRUCTIONS})",
+    )
+    parser.add_argument(
+        "-j", "--jit", action="store_true", help="compile hot code into Python"
+    )
+    parser.add_argument(
+        "--json", metavar="FILE", help="also write the results as JSON ('-' for stdout)"
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    programs = args.programs or sorted(glob.glob(path.join(PROGRAMS_DIR, "*.ls8")))
+    results = [benchmark(program, args.max_instructions, args.jit) for program in programs]
+
+    if args.json:
+        report = {
+            "python": platform.python_version(),
+            "jit": args.jit,
+            "max_instructions": args.max_instructions,
+            "results": results,
+        }
+        if args.json == "-":
+            print(json.dumps(report, indent=2))
+        else:
+            with open(args.json, "w") as json_file:
+                json.dump(report, json_file, indent=2)
+            print_report(results)
+    else:
+        print_report(results)
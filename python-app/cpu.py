@@ -1,14 +1,205 @@
 """CPU functionality."""
 
-import sys
-from time import time, sleep
+import asyncio
+import struct
+import threading
+from collections import namedtuple
+from time import perf_counter, time
+
+import image
+from output import OutputDevice
+from tracer import TraceBuffer
+
+# Default clock rate in instructions per second
+# Roughly matches the old fixed 5 ms sleep per instruction
+DEFAULT_CLOCK_HZ = 200
+
+# How many times per second a throttled CPU sleeps
+# Instructions are executed in batches between sleeps
+THROTTLE_RATE = 100
+
+# Instructions executed between wall clock timer checks when running unthrottled
+SLICE_SIZE = 4096
+
+# How many times an address has to be reached before the JIT compiles a block there
+JIT_THRESHOLD = 8
+
+# Longest basic block the JIT will compile, in instructions
+JIT_MAX_BLOCK = 64
+
+# Inline Python for instructions the JIT compiles without calling a handler
+# Registers live in locals r0-r7, {a} / {b} are the operands
+JIT_TEMPLATES = {
+    # NOP
+    0x00: "",
+    # LDI
+    0x82: "r{a} = {b} & 0xFF",
+    # LD
+    0x83: "r{a} = ram[r{b}]",
+    # ADD
+    0xA0: "r{a} = (r{a} + r{b}) & 0xFF",
+    # ADDi
+    0xA6: "r{a} = (r{a} + {b}) & 0xFF",
+    # SUB
+    0xA1: "r{a} = (r{a} - r{b}) & 0xFF",
+    # MUL
+    0xA2: "r{a} = (r{a} * r{b}) & 0xFF",
+    # INC
+    0x65: "r{a} = (r{a} + 1) & 0xFF",
+    # DEC
+    0x66: "r{a} = (r{a} - 1) & 0xFF",
+    # SHL
+    0xAC: "r{a} = (r{a} << r{b}) & 0xFF",
+    # SHR
+    0xAD: "r{a} = r{a} >> r{b}",
+    # NOT
+    0x69: "r{a} = ~r{a} & 0xFF",
+    # AND
+    0xA8: "r{a} = r{a} & r{b}",
+    # OR
+    0xAA: "r{a} = r{a} | r{b}",
+    # XOR
+    0xAB: "r{a} = r{a} ^ r{b}",
+    # CMP
+    0xA7: "fl = 2 if r{a} > r{b} else 4 if r{a} < r{b} else 1",
+}
+
+# Instructions that store their result in register A
+# If that register is IM or IS the pending interrupt flag has to be recomputed
+WRITES_REGISTER_A = {
+    # LDI, LD, POP
+    0x82, 0x83, 0x46,
+    # ADD, ADDi, SUB, MUL, DIV, MOD, INC, DEC
+    0xA0, 0xA6, 0xA1, 0xA2, 0xA3, 0xA4, 0x65, 0x66,
+    # SHL, SHR, AND, OR, XOR, NOT
+    0xAC, 0xAD, 0xA8, 0xAA, 0xAB, 0x69,
+}
+
+# Instructions whose operand B is an immediate rather than a register
+JIT_IMMEDIATE_B = {
+    # LDI
+    0x82,
+    # ADDi
+    0xA6,
+}
+
+# Branch conditions for the JIT, None is an unconditional jump
+JIT_BRANCHES = {
+    # JMP
+    0x54: None,
+    # JEQ
+    0x55: "fl & 0b00000001",
+    # JNE
+    0x56: "fl ^ 0b00000001",
+    # JGT
+    0x57: "fl & 0b00000010",
+    # JLT
+    0x58: "fl & 0b00000100",
+    # JLE
+    0x59: "fl & 0b00000101",
+    # JGE
+    0x5A: "fl & 0b00000011",
+}
+
+# Longest loop, in instructions, checked for being an idle loop
+IDLE_LOOP_MAX = 8
+
+# Batch size right after an interrupt while skipping idle loops, so a short
+# handler returns to the idle loop and it is spotted in the same timer period
+IDLE_SETTLE = 64
+
+# Instructions that only touch registers and flags, loops made of nothing else
+# can't change anything once they come back around with the same registers
+IDLE_OPCODES = {
+    # NOP, LDI, LD, CMP
+    0x00, 0x82, 0x83, 0xA7,
+    # JMP, JEQ, JNE, JGT, JLT, JLE, JGE
+    0x54, 0x55, 0x56, 0x57, 0x58, 0x59, 0x5A,
+    # ADD, ADDi, SUB, MUL, DIV, MOD, INC, DEC
+    0xA0, 0xA6, 0xA1, 0xA2, 0xA3, 0xA4, 0x65, 0x66,
+    # SHL, SHR, AND, OR, XOR, NOT
+    0xAC, 0xAD, 0xA8, 0xAA, 0xAB, 0x69,
+}
+
+
+# Why CPU.run returned
+EXIT_HALT = "halt"
+EXIT_FAULT = "fault"
+EXIT_BUDGET = "budget"
+EXIT_BREAK = "break"
+
+# Result of CPU.run
+# reason: EXIT_HALT, EXIT_FAULT, EXIT_BUDGET (cycle budget or deadline reached)
+#         or EXIT_BREAK (debugger breakpoint or watchpoint hit)
+# cycles: cycles executed by this run
+# elapsed: wall time in seconds
+# state: final machine state, see CPU.state
+# fault: description of the fault or of the breakpoint / watchpoint hit, if any
+RunResult = namedtuple("RunResult", ["reason", "cycles", "elapsed", "state", "fault"])
+
+
+# Snapshot layout: header followed by the 8 registers and 256 bytes of RAM
+# magic, version, pc, ir, fl, interrupts_enabled, cycles, next timer cycle (-1 for none)
+SNAPSHOT_MAGIC = b"LS8S"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct("<4sBHBBBQq")
+
+
+class Halt(Exception):
+    """Raised by HLT to stop the run loop."""
+
+
+class DebugBreak(Exception):
+    """Stops a debugged run at a breakpoint or watchpoint."""
+
+
+class CPUFault(Exception):
+    """Raised when the CPU can't continue, e.g. unknown instruction or division by 0."""
 
 
 class CPU:
     """Main CPU class."""
 
-    def __init__(self):
-        """Construct a new CPU."""
+    def __init__(
+        self, clock_hz=DEFAULT_CLOCK_HZ, jit=False, timer_cycles=None, output=None, idle=True
+    ):
+        """
+        Construct a new CPU.
+
+        clock_hz is the target clock rate in instructions per second.
+        Pass None (or 0) to run unthrottled in "turbo" mode.
+
+        jit compiles hot basic blocks into Python functions.
+
+        timer_cycles makes the timer interrupt fire every timer_cycles emulated
+        cycles, which is deterministic. By default it fires once per second of
+        wall clock time, checked between batches of instructions.
+
+        output is the OutputDevice PRN / PRA / PRM write to, stdout by default.
+
+        idle detects loops that spin waiting for an interrupt, like JMP to
+        itself. Instead of executing them the CPU skips ahead to the next
+        virtual timer interrupt, or sleeps until the next wall clock timer
+        interrupt or a device calls wake().
+        """
+        # Target clock rate, falsy means never sleep
+        self.clock_hz = clock_hz
+
+        # Virtual timer period in cycles, None syncs the timer to the wall clock
+        self.timer_cycles = timer_cycles
+
+        # Buffered output device
+        self.output = output if output is not None else OutputDevice()
+
+        # Basic block compiler state
+        self.jit = jit
+        self._jit_reset()
+
+        # Idle loop detection, and what ends an idle sleep early
+        self.idle = idle
+        self._wakeup = threading.Event()
+        self._async_wakeup = None
+
         # Program Counter
         # Holds address of currently executing instruction
         self.pc = 0
@@ -24,14 +215,17 @@ class CPU:
         self.fl = 0
 
         # RAM - LS8 has 1 byte addressing so only 256 possible locations to read from / write to
-        self.ram = [0] * 256
+        # Backed by a bytearray so it is compact and can be exposed without copying
+        self.ram = bytearray(256)
 
         # General Purpose Registers
         # The following are reserved:
         # R5 - Interrupt Mask (IM)
         # R6 - Interrupt Status (IS)
         # R7 - Stack Pointer (SP)
-        self.reg = [0] * 8
+        # Also a bytearray, storing anything outside 0-255 raises instead of silently
+        # holding an out of range value
+        self.reg = bytearray(8)
 
         self.imr = 5
         self.isr = 6
@@ -45,88 +239,45 @@ class CPU:
 
         self.interrupts_enabled = True
 
+        # Halt or fault that stopped the current run
+        self._stop = None
+
+        # Set when interrupts are enabled and IM & IS is non-zero
+        # Only recomputed when IM, IS or interrupts_enabled change so the run loop
+        # just has to test this flag before each fetch
+        self._interrupt_pending = False
+
         # What bit the timer uses for its interrupt
         self.timer_interrupt_bit = 0
 
-        # All non-alu instructions understood by the CPU
-        self.instructions = {
-            # NOP
-            0x00: lambda: self._NOP(),
-            # HLT
-            0x01: lambda: exit(),
-            # PRA
-            0x48: lambda: self._PRA(self._operand_a),
-            # PRM
-            0x49: lambda: self._PRM(self._operand_a, self._operand_b),
-            # PRN
-            0x47: lambda: self._PRN(self._operand_a),
-            # LD
-            0x83: lambda: self._LD(self._operand_a, self._operand_b),
-            # LDI
-            0x82: lambda: self._LDI(self._operand_a, self._operand_b),
-            # ST
-            0x84: lambda: self._ST(self._operand_a, self._operand_b),
-            # PUSH
-            0x45: lambda: self._PUSH(self._operand_a),
-            # POP
-            0x46: lambda: self._POP(self._operand_a),
-            # CALL
-            0x50: lambda: self._CALL(self._operand_a),
-            # RET
-            0x11: lambda: self._RET(),
-            # INT
-            0x52: lambda: self._INT(self._operand_a),
-            # IRET
-            0x13: lambda: self._IRET(),
-            # JMP
-            0x54: lambda: self._JMP(self._operand_a),
-            # JLT
-            0x58: lambda: self._JLT(self._operand_a),
-            # JGT
-            0x57: lambda: self._JGT(self._operand_a),
-            # JEQ
-            0x55: lambda: self._JEQ(self._operand_a),
-            # JLE
-            0x59: lambda: self._JLE(self._operand_a),
-            # JGE
-            0x5A: lambda: self._JGE(self._operand_a),
-            # JNE
-            0x56: lambda: self._JNE(self._operand_a),
-        }
+        # Total cycles (instructions) executed
+        self.cycles = 0
 
-        # All alu instructions
-        self.alu_instructions = {
-            # ADD
-            0xA0: lambda: self._ALU_ADD(self._operand_a, self._operand_b),
-            # ADDi
-            0xA6: lambda: self._ALU_ADDi(self._operand_a, self._operand_b),
-            # SUB
-            0xA1: lambda: self._ALU_SUB(self._operand_a, self._operand_b),
-            # MUL
-            0xA2: lambda: self._ALU_MUL(self._operand_a, self._operand_b),
-            # DIV
-            0xA3: lambda: self._ALU_DIV(self._operand_a, self._operand_b),
-            # MOD
-            0xA4: lambda: self._ALU_MOD(self._operand_a, self._operand_b),
-            # INC
-            0x65: lambda: self._ALU_INC(self._operand_a),
-            # DEC
-            0x66: lambda: self._ALU_DEC(self._operand_a),
-            # SHL
-            0xAC: lambda: self._ALU_SHL(self._operand_a, self._operand_b),
-            # SHR
-            0xAD: lambda: self._ALU_SHR(self._operand_a, self._operand_b),
-            # AND
-            0xA8: lambda: self._ALU_AND(self._operand_a, self._operand_b),
-            # OR
-            0xAA: lambda: self._ALU_OR(self._operand_a, self._operand_b),
-            # XOR
-            0xAB: lambda: self._ALU_XOR(self._operand_a, self._operand_b),
-            # NOT
-            0x69: lambda: self._ALU_NOT(self._operand_a),
-            # CMP
-            0xA7: lambda: self._ALU_CMP(self._operand_a, self._operand_b),
-        }
+        # Cycle count at which the virtual timer fires next
+        self._next_timer = timer_cycles
+
+        # Decode cache, one entry per RAM address
+        # Each entry holds (handler, operands, length, updates_pc) for the instruction
+        # starting at that address so it only has to be decoded once
+        self._decoded = [None] * 256
+
+        # Peripherals polled between batches of instructions and after IRET
+        self.devices = []
+
+        # profiler.Profiler collecting statistics, None runs without profiling
+        self.profiler = None
+
+        # tracer.TraceBuffer run(trace_cycle=True) records into, created on first use
+        self.tracer = None
+
+        # debugger.Debugger with breakpoints and watchpoints, None runs without them
+        self.debugger = None
+
+        # mmu.MMU switching banks into part of the address space, None for plain RAM
+        self.mmu = None
+
+        # Functions called on every write through _ram_write, see add_write_hook
+        self._write_hooks = []
 
     @staticmethod
     def set_nth_bit(b, n):
@@ -136,51 +287,153 @@ class CPU:
     def unset_nth_bit(b, n):
         return b & ~(1 << n)
 
-    @property
-    def _operand_a(self):
-        return self.ram[self.pc + 1]
+    def reset(self):
+        """
+        Returns the machine to its power on state so the instance can be reused
+        """
+        self.pc = 0
+        self.ir = 0
+        self.fl = 0
+
+        # Clear in place so views handed out earlier stay valid
+        self.ram[:] = bytes(len(self.ram))
+        self.reg[:] = bytes(len(self.reg))
+        self.reg[self.spr] = 0xF4
+
+        self.interrupts_enabled = True
+        self._interrupt_pending = False
+        self._stop = None
+
+        self.cycles = 0
+        self._next_timer = self.timer_cycles
 
-    @property
-    def _operand_b(self):
-        return self.ram[self.pc + 2]
+        self._decoded[:] = [None] * 256
+        self._jit_reset()
+
+        # Banks outlive the reset, map bank 0 back in
+        if self.mmu is not None:
+            self.mmu.select(0)
 
     def raise_interrupt(self, i):
         """
         Called externally by a peripheral to raise an interrupt within CPU
         """
         self.reg[self.isr] = self.set_nth_bit(self.reg[self.isr], i)
+        self._update_interrupt_pending()
+
+    def attach(self, device):
+        """
+        Connects a peripheral that has a poll() method
+        """
+        self.devices.append(device)
+
+    def detach(self, device):
+        """
+        Disconnects a peripheral
+        """
+        if device in self.devices:
+            self.devices.remove(device)
+
+    def add_write_hook(self, hook):
+        """
+        Calls hook(address, value) before every write through _ram_write (ST,
+        PUSH, CALL, interrupts and DMA), in the order hooks were added.
+        A hook can fault to stop the write
+        """
+        self._write_hooks.append(hook)
+
+        # Instance attribute shadows CPU._ram_write for this CPU only
+        self._ram_write = self._hooked_ram_write
+
+    def remove_write_hook(self, hook):
+        """
+        Stops calling hook on writes
+        """
+        if hook in self._write_hooks:
+            self._write_hooks.remove(hook)
+
+        # Back to the plain write once nothing is hooked
+        if not self._write_hooks:
+            self.__dict__.pop("_ram_write", None)
+
+    def _poll_devices(self):
+        """
+        Lets each peripheral raise an interrupt if it has something to deliver
+        """
+        for device in self.devices:
+            device.poll()
+
+    def dma_write(self, address, value):
+        """
+        Called externally by a peripheral to write directly into memory
+        """
+        self._ram_write(address & 0xFF, value & 0xFF)
+
+    def memory_view(self, start=0, end=256):
+        """
+        Returns a zero-copy view of RAM between start and end
+        """
+        return memoryview(self.ram)[start:end]
+
+    def register_view(self):
+        """
+        Returns a zero-copy view of the general purpose registers
+        """
+        return memoryview(self.reg)
+
+    def dump_memory(self, output_file):
+        """
+        Writes the whole of RAM to a binary file in a single write
+        """
+        with open(output_file, "wb") as dump_file:
+            dump_file.write(self.ram)
 
     def load(self, input_file):
-        """Loads a program from a file into memory."""
-        address = 0
+        """
+        Loads a program from a file into memory.
 
-        # Open program file, loop -> parse line (ignore comments), store into memory at address, inc address
-        program_file = open(input_file, "r")
+        Accepts text .ls8 programs, which are converted to a cached binary image,
+        or binary images directly. PC is set to the image entry point.
+        """
+        load_address, entry_point, size = image.load_program(input_file, self.ram)
+        self._loaded(load_address, entry_point, size)
 
-        for line in program_file:
-            # Remove whitespace
-            line = line.strip()
+    def load_bytes(self, program, load_address=0, entry_point=0):
+        """
+        Loads a program already in memory, as bytes, and sets PC to entry_point
+        """
+        if load_address + len(program) > len(self.ram):
+            raise ValueError("program does not fit in memory")
 
-            # Ignore blank lines
-            if not line:
-                continue
+        self.ram[load_address : load_address + len(program)] = program
+        self._loaded(load_address, entry_point, len(program))
 
-            # Ignore lines that start with comments
-            if line[0] == "#":
-                continue
+    def _loaded(self, load_address, entry_point, size):
+        self.pc = entry_point
 
-            # All instructions are 1 byte so just
-            # take the first 8 chars and convert
-            # to a binary number
-            instruction = int(line[:8], 2)
+        # Pre-decode the loaded program
+        self._decoded[:] = [None] * 256
+        self._jit_reset()
+        for address in range(load_address, load_address + size):
+            self._decode(address)
 
-            # Insert instruction into memory
-            self.ram[address] = instruction
+        # Program bytes that landed in the bank window belong to the selected bank
+        if self.mmu is not None:
+            self.mmu.sync()
 
-            # Inc to next pos in memory
-            address += 1
+    def _forget(self, addresses):
+        """
+        Drops cached instructions and compiled blocks covering addresses whose
+        bytes were changed directly in RAM, like _ram_write does
+        """
+        decoded = self._decoded
+        for address in addresses:
+            decoded[address] = None
+            decoded[(address - 1) & 0xFF] = None
+            decoded[(address - 2) & 0xFF] = None
 
-        program_file.close()
+            if self._jit_cover[address]:
+                self._jit_invalidate(address)
 
     def _ram_read(self, mar):
         """
@@ -194,39 +447,94 @@ class CPU:
         """
         self.ram[mar] = mdr
 
-    def _alu(self, op):
-        """Executes ALU operations"""
+        # Drop any cached instruction that covers this address so
+        # self-modifying code is decoded again
+        decoded = self._decoded
+        decoded[mar] = None
+        decoded[(mar - 1) & 0xFF] = None
+        decoded[(mar - 2) & 0xFF] = None
 
-        # This will pull the correct function for the provided alu instruction
-        execute = self.alu_instructions.get(op, None)
+        # Same for compiled blocks
+        if self._jit_cover[mar]:
+            self._jit_invalidate(mar)
 
-        # Check if valid instruction
-        if execute is not None:
-            execute()
-        else:
-            print("Unsupported ALU operation.")
-            self._trace()
-            exit(1)
+    def _hooked_ram_write(self, mar, mdr):
+        """
+        _ram_write for a CPU with write hooks
+        """
+        for hook in self._write_hooks:
+            hook(mar, mdr)
+
+        CPU._ram_write(self, mar, mdr)
+
+    def _decode(self, address):
+        """
+        Decodes the instruction at address and stores it in the decode cache
+        """
+        instruction = self.ram[address]
+
+        # How many operands does this instruction require?
+        operands = (0b11000000 & instruction) >> 6
+
+        # Unknown instructions map to _TRAP, which only faults if actually executed
+        execute = self.dispatch[instruction]
+
+        # Does this instruction set the PC directly?
+        updates_pc = True if 0b00010000 & instruction else False
+
+        # PRM is encoded as a 1 operand instruction but reads registerB from the
+        # byte after registerA as well
+        reads = 2 if instruction == 0x49 else operands
+        values = tuple(self.ram[(address + i) & 0xFF] for i in range(1, reads + 1))
+
+        # Writing IM or IS may change whether an interrupt is pending
+        if instruction in WRITES_REGISTER_A and values[0] in (self.imr, self.isr):
+            execute = self._updates_interrupt_pending(execute)
+
+        entry = (
+            execute,
+            values,
+            # Instruction length, + 1 for the instruction itself
+            1 + operands,
+            updates_pc,
+        )
+        self._decoded[address] = entry
+
+        return entry
+
+    @staticmethod
+    def _updates_interrupt_pending(handler):
+        """
+        Wraps an instruction handler so the pending interrupt flag is recomputed after it runs
+        """
+
+        def execute(cpu, *operands):
+            handler(cpu, *operands)
+            cpu._update_interrupt_pending()
+
+        return execute
 
     def _handle_interrupts(self):
         """
         Checks and services interrupts from the interrupt service register
+
+        Faults if PC ran past the end of RAM, as there is no address to return to
         """
+        if self.pc >= len(self.ram):
+            raise CPUFault("Invalid register or memory access.")
 
         # Get active and enabled interrupts
         masked_interrupts = self.reg[self.imr] & self.reg[self.isr]
 
-        for i in range(1, len(self.ivt) + 1):
-            # Check interrupt
-            i_bit = i & masked_interrupts
-
-            # Is interrupt active?
-            if i_bit:
+        for i in range(len(self.ivt)):
+            # Is interrupt i active?
+            if masked_interrupts >> i & 1:
                 # Disable interrupt handling until this one is serviced
                 self.interrupts_enabled = False
+                self._interrupt_pending = False
 
                 # Clear interrupt bit in IS
-                self.reg[self.isr] = self.unset_nth_bit(self.reg[self.isr], i - 1)
+                self.reg[self.isr] = self.unset_nth_bit(self.reg[self.isr], i)
 
                 # Push processor state on stack
                 # PC and flag register
@@ -239,16 +547,29 @@ class CPU:
                     self._PUSH(r=None, value=self.reg[r])
 
                 # Jump to interrupt handler
-                self.pc = self.ram[self.ivt[i - 1]]
+                self.pc = self.ram[self.ivt[i]]
 
                 # Exit interrupt checking loop to service current interrupt
                 break
 
+    def _update_interrupt_pending(self):
+        """
+        Recomputes the pending interrupt flag, call whenever IM, IS or
+        interrupts_enabled change
+        """
+        self._interrupt_pending = self.interrupts_enabled and bool(
+            self.reg[self.imr] & self.reg[self.isr]
+        )
+
     def _trace(self):
         """
-        Handy function to print out the CPU state. You might want to call this
-        from run() if you need help debugging.
+        Handy function to print out the CPU state.
+
+        run(trace_cycle=True) records every instruction into self.tracer
+        instead, see tracer.py.
         """
+        # Keep program output and trace lines in order
+        self.output.flush()
 
         print(
             f"TRACE: %02X | %02X %02X %02X |"
@@ -268,81 +589,826 @@ class CPU:
 
         print()
 
-    def _read_instruction(self):
+    def _execute(self, count, trace_cycle=False):
+        """
+        Interprets up to count instructions, returns how many were executed
+
+        If the program halts or faults the exception is kept in self._stop and
+        the count includes the instruction that stopped it.
+        """
+        ram = self.ram
+        decoded = self._decoded
+        executed = 0
+
+        try:
+            for executed in range(count):
+                # Prior to instruction fetch, check interrupts if enabled
+                if self._interrupt_pending:
+                    self._handle_interrupts()
+
+                pc = self.pc
+
+                # Load instruction from RAM at address PC into IR
+                self.ir = ram[pc]
+
+                # Record trace if param set
+                if trace_cycle:
+                    self.tracer.record(self, self.cycles + executed)
+
+                # Get decoded instruction for the current PC and execute it
+                execute, operands, length, updates_pc = decoded[pc] or self._decode(pc)
+                execute(self, *operands)
+
+                # If the instruction doesn't set the PC itself, then we must increment it ourselves
+                if not updates_pc:
+                    # Increment program counter by instruction length
+                    self.pc += length
+        except (Halt, CPUFault) as stop:
+            self._stop = stop
+            return executed + 1
+        except IndexError:
+            # Register operand above R7 or PC past the end of RAM
+            self._stop = CPUFault("Invalid register or memory access.")
+            return executed + 1
+
+        return count
+
+    def _execute_profiled(self, count, trace_cycle=False):
+        """
+        Same as _execute, but records what runs into self.profiler
+        """
+        ram = self.ram
+        decoded = self._decoded
+        profiler = self.profiler
+        opcodes = profiler.opcodes
+        addresses = profiler.addresses
+        handler_time = profiler.handler_time
+        executed = 0
+
+        try:
+            for executed in range(count):
+                if self._interrupt_pending:
+                    start = perf_counter()
+                    self._handle_interrupts()
+                    profiler.interrupt_time += perf_counter() - start
+                    profiler.interrupts += 1
+
+                pc = self.pc
+                self.ir = ir = ram[pc]
+
+                if trace_cycle:
+                    self.tracer.record(self, self.cycles + executed)
+
+                opcodes[ir] += 1
+                addresses[pc] += 1
+
+                execute, operands, length, updates_pc = decoded[pc] or self._decode(pc)
+                start = perf_counter()
+                execute(self, *operands)
+                handler_time[ir] += perf_counter() - start
+
+                if not updates_pc:
+                    self.pc += length
+        except (Halt, CPUFault) as stop:
+            self._stop = stop
+            return executed + 1
+        except IndexError:
+            self._stop = CPUFault("Invalid register or memory access.")
+            return executed + 1
+
+        return count
+
+    def _execute_debug(self, count, trace_cycle=False):
+        """
+        Same as _execute, but stops at the breakpoints and watchpoints of
+        self.debugger with a DebugBreak in self._stop
+
+        Breakpoints stop before the instruction runs, watchpoints right after
+        the write.
+        """
+        ram = self.ram
+        decoded = self._decoded
+        debugger = self.debugger
+        breakpoints = debugger.breakpoints
+        executed = 0
+
+        try:
+            for executed in range(count):
+                # Writes and register changes since the last instruction
+                if debugger.watching and debugger.check():
+                    self._stop = DebugBreak(debugger.hit)
+                    return executed
+
+                if self._interrupt_pending:
+                    self._handle_interrupts()
+
+                    # Writes the interrupt made pushing state, before the
+                    # handler runs
+                    if debugger.watching and debugger.check():
+                        self._stop = DebugBreak(debugger.hit)
+                        return executed
+
+                pc = self.pc
+
+                # Don't stop again at the breakpoint the run is continuing from
+                if breakpoints >> pc & 1 and not debugger.resuming:
+                    self._stop = DebugBreak(f"breakpoint at 0x{pc:02X}")
+                    debugger.resuming = True
+                    return executed
+                debugger.resuming = False
+
+                self.ir = ram[pc]
+
+                if trace_cycle:
+                    self.tracer.record(self, self.cycles + executed)
+
+                execute, operands, length, updates_pc = decoded[pc] or self._decode(pc)
+                execute(self, *operands)
+
+                if not updates_pc:
+                    self.pc += length
+        except (Halt, CPUFault) as stop:
+            self._stop = stop
+            return executed + 1
+        except IndexError:
+            self._stop = CPUFault("Invalid register or memory access.")
+            return executed + 1
+
+        if debugger.watching and debugger.check():
+            self._stop = DebugBreak(debugger.hit)
+
+        return count
+
+    def run(self, trace_cycle=False, max_cycles=None, deadline=None):
+        """
+        Starts the emulator execution loop
+
+        Runs until the program halts or faults, max_cycles cycles have been
+        executed, or the deadline (a time() timestamp) has passed.
+        Returns a RunResult.
+        """
+        slices = self._run_slices(trace_cycle, max_cycles, deadline)
+
+        try:
+            while True:
+                delay = next(slices)
+                if delay > 0:
+                    # Sleep, unless a device has something for the CPU first
+                    self._wakeup.wait(delay)
+                    self._wakeup.clear()
+        except StopIteration as done:
+            return done.value
+
+    async def run_async(self, trace_cycle=False, max_cycles=None, deadline=None):
+        """
+        Same as run() but yields to the event loop after every batch of
+        instructions, and throttles with asyncio.sleep() instead of blocking
+
+        Many CPUs and their devices can share one event loop this way.
+        """
+        slices = self._run_slices(trace_cycle, max_cycles, deadline)
+        wakeup = asyncio.Event()
+        self._async_wakeup = (asyncio.get_running_loop(), wakeup)
+
+        try:
+            while True:
+                delay = next(slices)
+                await self.output.drain()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    wakeup.clear()
+                else:
+                    await asyncio.sleep(0)
+        except StopIteration as done:
+            await self.output.drain()
+            return done.value
+        finally:
+            self._async_wakeup = None
+
+    def wake(self):
+        """
+        Ends the current sleep early, for devices that have something to
+        deliver while the CPU is idle. Safe to call from any thread
+        """
+        self._wakeup.set()
+
+        if self._async_wakeup is not None:
+            loop, wakeup = self._async_wakeup
+            loop.call_soon_threadsafe(wakeup.set)
+
+    def _run_slices(self, trace_cycle, max_cycles, deadline):
+        """
+        Execution loop shared by run() and run_async()
+
+        Executes a batch of instructions at a time and yields how long to
+        wait before the next batch, 0 when unthrottled. Returns a RunResult.
+        """
+        start = perf_counter()
+        start_cycles = self.cycles
+        end_cycles = None if max_cycles is None else start_cycles + max_cycles
+        self._stop = None
+        reason = EXIT_BUDGET
+
+        if trace_cycle and self.tracer is None:
+            self.tracer = TraceBuffer()
+
+        # Tracing and profiling need to see every instruction so they always go
+        # through the interpreter
+        if self.debugger is not None:
+            execute = self._execute_debug
+        elif self.profiler is not None:
+            execute = self._execute_profiled
+        elif self.jit and not trace_cycle:
+            execute = self._execute_jit
+        else:
+            execute = self._execute
+
+        # Idle loops are skipped, unless something wants to see every instruction.
+        # Unthrottled virtual time jumps ahead to the next timer interrupt,
+        # otherwise the CPU sleeps until the timer or a device wakes it, unless
+        # it's running flat out towards a cycle budget on the wall clock timer
+        detect_idle = (
+            self.idle and self.debugger is None and self.profiler is None and not trace_cycle
+        )
+
+        # Timer setup
+        # The virtual timer counts cycles, otherwise sync to the wall clock
+        virtual_timer = bool(self.timer_cycles)
+        if not virtual_timer:
+            timer_start = time()
+
+        # Throttle setup
+        # Instead of sleeping after every instruction, sleep once per batch
+        # against a deadline so the average rate matches clock_hz
+        throttled = bool(self.clock_hz)
+        if throttled:
+            batch_size = max(1, self.clock_hz // THROTTLE_RATE)
+            batch_period = batch_size / self.clock_hz
+            batch_deadline = time() + batch_period
+        else:
+            batch_size = SLICE_SIZE
+
+        skip_idle = detect_idle and virtual_timer and not throttled
+        sleep_idle = detect_idle and (throttled or not virtual_timer and end_cycles is None)
+
+        while True:
+            size = batch_size
+
+            # Check for an idle loop again soon after an interrupt
+            if skip_idle and self._interrupt_pending:
+                size = IDLE_SETTLE
+
+            # Stop the batch exactly where the timer is due
+            if virtual_timer:
+                size = min(size, self._next_timer - self.cycles)
+
+            # Or where the cycle budget runs out
+            if end_cycles is not None:
+                if self.cycles >= end_cycles:
+                    break
+                size = min(size, end_cycles - self.cycles)
+
+            self.cycles += execute(max(0, size), trace_cycle)
+
+            if skip_idle and self._stop is None and not self._interrupt_pending:
+                loop = self._idle_loop(end_cycles)
+                if loop:
+                    # Nothing happens until the timer fires, skip straight to it
+                    # in whole loop iterations so the state is exactly as if
+                    # the loop had run
+                    until = self._next_timer
+                    if end_cycles is not None:
+                        until = min(until, end_cycles)
+                    self.cycles += (until - self.cycles) // loop * loop
+
+            # Write out whatever the batch printed
+            if self.output.buffer:
+                self.output.flush()
+
+            # HLT, a fault or the debugger
+            if self._stop is not None:
+                if isinstance(self._stop, Halt):
+                    reason = EXIT_HALT
+                elif isinstance(self._stop, DebugBreak):
+                    reason = EXIT_BREAK
+                else:
+                    reason = EXIT_FAULT
+                break
+
+            if virtual_timer:
+                # Activate timer interrupt every timer_cycles cycles
+                if self.cycles >= self._next_timer:
+                    # INT
+                    self.raise_interrupt(self.timer_interrupt_bit)
+                    self._next_timer += self.timer_cycles
+            else:
+                # Activate timer interrupt if 1 second has past
+                timer_check = time()
+                if timer_check - timer_start > 1:
+                    # INT
+                    self.raise_interrupt(self.timer_interrupt_bit)
+                    # Reset timer
+                    timer_start = time()
+
+            if self.devices:
+                self._poll_devices()
+
+            if deadline is not None and time() >= deadline:
+                break
+
+            if sleep_idle and not self._interrupt_pending:
+                cycles = self.cycles
+                loop = self._idle_loop(end_cycles)
+                if throttled:
+                    batch_deadline += (self.cycles - cycles) / self.clock_hz
+
+                # Stepping through the loop faulted, it can't halt as HLT
+                # isn't an idle loop instruction
+                if self._stop is not None:
+                    reason = EXIT_FAULT
+                    break
+
+                if loop:
+                    # Sleep until the timer fires or a device wakes the CPU,
+                    # then count the cycles the loop would have run meanwhile
+                    idle_cycles = None
+                    if virtual_timer:
+                        idle_cycles = self._next_timer - self.cycles
+                    if end_cycles is not None:
+                        idle_cycles = min(
+                            end_cycles - self.cycles,
+                            idle_cycles if idle_cycles is not None else end_cycles,
+                        )
+
+                    if virtual_timer:
+                        wait = idle_cycles / self.clock_hz
+                    else:
+                        # The wall clock timer is due in under a second
+                        # whatever the cycle budget
+                        wait = timer_start + 1 - time()
+                        if idle_cycles is not None:
+                            wait = min(wait, idle_cycles / self.clock_hz)
+                    if deadline is not None:
+                        wait = min(wait, deadline - time())
+
+                    idle_start = time()
+                    yield max(wait, 0)
+
+                    if throttled:
+                        passed = int((time() - idle_start) * self.clock_hz)
+                        if idle_cycles is not None:
+                            passed = min(passed, idle_cycles)
+                        self.cycles += passed // loop * loop
+                        batch_deadline = time() + batch_period
+                    continue
+
+            # Throttle to the configured clock rate
+            if throttled:
+                delay = batch_deadline - time()
+                if delay > 0:
+                    yield delay
+                    batch_deadline += batch_period
+                else:
+                    # Fell behind, don't try to catch up with a burst
+                    batch_deadline = time() + batch_period
+                    yield 0
+            else:
+                yield 0
+
+        self.output.flush()
+        if trace_cycle:
+            self.tracer.flush()
+
+        return RunResult(
+            reason=reason,
+            cycles=self.cycles - start_cycles,
+            elapsed=perf_counter() - start,
+            state=self.state(),
+            fault=str(self._stop) if reason in (EXIT_FAULT, EXIT_BREAK) else None,
+        )
+
+    def _idle_loop(self, end_cycles=None):
+        """
+        Checks whether the CPU is spinning in an idle loop by stepping through
+        the loop at PC, never past the next virtual timer interrupt or
+        end_cycles
+
+        An idle loop only reads registers, flags and memory and comes back
+        around to the same registers and flags, so it would spin forever until
+        an interrupt. The instructions stepped through count as executed.
+        Returns the loop length in instructions, 0 when the CPU isn't idle.
+        """
+        start = self.pc
+        ram = self.ram
+
+        if start >= len(ram) or ram[start] not in IDLE_OPCODES:
+            return 0
+
+        limit = IDLE_LOOP_MAX
+        if self.timer_cycles:
+            limit = min(limit, self._next_timer - self.cycles)
+        if end_cycles is not None:
+            limit = min(limit, end_cycles - self.cycles)
+
+        registers = bytes(self.reg)
+        fl = self.fl
+        executed = 0
+
+        while executed < limit and ram[self.pc] in IDLE_OPCODES:
+            executed += self._execute(1)
+
+            if self._stop is not None or self.pc >= len(ram):
+                break
+
+            if self.pc == start:
+                if self.reg == registers and self.fl == fl:
+                    self.cycles += executed
+                    return executed
+                break
+
+        self.cycles += executed
+        return 0
+
+    def state(self):
         """
-        Load instruction from RAM[pc] into the IR 
+        Returns a copy of the machine state as a dict
         """
-        self.ir = self._ram_read(self.pc)
+        return {
+            "pc": self.pc,
+            "ir": self.ir,
+            "fl": self.fl,
+            "reg": bytes(self.reg),
+            "ram": bytes(self.ram),
+            "interrupts_enabled": self.interrupts_enabled,
+            "cycles": self.cycles,
+        }
 
-    def _execute_instruction(self):
+    def snapshot(self):
+        """
+        Returns the full machine state as a compact bytes blob for restore()
         """
-        Executes instruction located in the IR
+        return (
+            SNAPSHOT_HEADER.pack(
+                SNAPSHOT_MAGIC,
+                SNAPSHOT_VERSION,
+                self.pc,
+                self.ir,
+                self.fl,
+                self.interrupts_enabled,
+                self.cycles,
+                -1 if self._next_timer is None else self._next_timer,
+            )
+            + self.reg
+            + self.ram
+        )
+
+    def restore(self, snapshot):
         """
-        # Get instruction from IR
-        instruction = self.ir
+        Returns the machine to the state saved by snapshot()
 
-        # How many operands does this instruction require?
-        # Used for incrementing the PC by correct amount
-        operands = (0b11000000 & self.ir) >> 6
+        Only instructions whose bytes differ from the snapshot are decoded or
+        compiled again, so restoring repeatedly from a warmed up state is cheap.
+        """
+        header = SNAPSHOT_HEADER.size
+        reg_end = header + len(self.reg)
 
-        # Is this an ALU operation?
-        is_alu_op = True if 0b00100000 & self.ir else False
+        if len(snapshot) != reg_end + len(self.ram):
+            raise ValueError("snapshot does not match this machine")
 
-        # Make the ALU handle instruction if this is an ALU operation
-        if is_alu_op:
-            self._alu(instruction)
+        magic, version, pc, ir, fl, interrupts_enabled, cycles, next_timer = (
+            SNAPSHOT_HEADER.unpack_from(snapshot)
+        )
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError("not an LS-8 snapshot")
+
+        ram = memoryview(snapshot)[reg_end:]
+
+        if self.ram != ram:
+            changed = [address for address in range(256) if self.ram[address] != ram[address]]
+            self.ram[:] = ram
+            self._forget(changed)
+
+            if self.mmu is not None:
+                self.mmu.sync()
+
+        self.reg[:] = snapshot[header:reg_end]
+        self.pc = pc
+        self.ir = ir
+        self.fl = fl
+        self.interrupts_enabled = bool(interrupts_enabled)
+        self.cycles = cycles
+        if next_timer >= 0:
+            self._next_timer = next_timer
+        elif self.timer_cycles:
+            # Taken on the wall clock timer, start a virtual timer period from here
+            self._next_timer = self.cycles + self.timer_cycles
         else:
-            # This will pull the correct function for the provided non-alu instruction
-            execute = self.instructions.get(self.ir, None)
+            self._next_timer = None
+        self._stop = None
+        self._update_interrupt_pending()
 
-            # Check if valid instruction
-            if execute is not None:
-                execute()
-            else:
-                print("Unknown instruction encountered.")
-                self._trace()
-                exit(1)
+    """
+    ******************************************************
+    JIT
+    ******************************************************
+    """
 
-        # Does this instruction set the PC directly?
-        updates_pc = True if 0b00010000 & self.ir else False
+    def _execute_jit(self, count, trace_cycle=False):
+        """
+        Executes up to count instructions, running compiled basic blocks where
+        available and interpreting everything else. Returns how many were executed
+
+        Halts and faults are handled like in _execute
+        """
+        blocks = self._jit_blocks
+        heat = self._jit_heat
+        executed = 0
+
+        while executed < count and self._stop is None:
+            # Interrupts are only checked at block boundaries
+            if self._interrupt_pending:
+                try:
+                    self._handle_interrupts()
+                except CPUFault as stop:
+                    # Counted like the interpreter counts it
+                    self._stop = stop
+                    executed += 1
+                    break
+
+            pc = self.pc
+            block = blocks.get(pc)
+
+            # Past the end of RAM the interpreter faults like it would without the JIT
+            if block is None and pc < len(heat):
+                # Compile once this address has been reached often enough
+                heat[pc] += 1
+                if heat[pc] >= JIT_THRESHOLD:
+                    block = self._jit_compile(pc)
+
+            # Interpret if there is no block or it would overrun count
+            if block is None or block.length > count - executed:
+                executed += self._execute(1)
+                continue
 
-        # If the instruction doesn't set the PC itself, then we must increment it ourselves
-        if not updates_pc:
-            # Increment program counter by instruction length
-            # Determined by last 2 bits of instruction for the operands + 1 for the instruction itself
-            self.pc += 1 + operands
+            try:
+                self.pc, n = block(self, self.reg, self.ram)
+            except (Halt, CPUFault) as stop:
+                # Only handler fallbacks can stop a block, they record how far it got
+                self._stop = stop
+                n = self._jit_done
+            except IndexError:
+                self._stop = CPUFault("Invalid register or memory access.")
+                n = self._jit_done
+            executed += n
 
-    def run(self, trace_cycle=False):
-        """Starts the emulator execution loop"""
+        return executed
 
-        # Timer setup
-        timer_start = time()
+    def _jit_compile(self, start):
+        """
+        Compiles the basic block starting at address start into a Python function.
 
-        while True:
-            # Prior to instruction fetch, check interrupts if enabled
-            if self.interrupts_enabled:
-                self._handle_interrupts()
+        The function takes (cpu, reg, ram), keeps registers in locals and returns
+        (next_pc, instructions_executed). Returns None if there is nothing to compile
+        """
+        generated = self._jit_source(start)
+        if generated is None:
+            return None
+
+        name, source, handlers, length, end = generated
+        namespace = {
+            handler: CPU._jit_handler(instruction, wrapped)
+            for handler, (instruction, wrapped) in handlers.items()
+        }
+        exec(compile(source, f"<ls8 block {start:#04x}>", "exec"), namespace)
+        block = namespace[name]
+        block.length = length
+
+        self._jit_install(start, block, end)
+        return block
+
+    def _jit_source(self, start):
+        """
+        Generates the source of the block function for the basic block starting
+        at address start
+
+        Returns (function name, source, handlers, instructions, end), handlers
+        maps the names the source calls to (opcode, wrapped) for _jit_handler
+        and end is one past the last byte the block was built from. Returns None
+        if there is nothing to compile
+        """
+        ram = self.ram
+        body = []
+        handlers = {}
+
+        # Registers known to hold a constant, so jumps through them have a fixed target
+        known = {}
+
+        # Registers / flags that have to be written back before leaving the block
+        dirty = set()
+        fl_dirty = False
+
+        def writeback():
+            lines = [f"reg[{r}] = r{r}" for r in sorted(dirty)]
+            if fl_dirty:
+                lines.append("cpu.fl = fl")
+            if self.imr in dirty or self.isr in dirty:
+                lines.append("cpu._update_interrupt_pending()")
+            return lines
+
+        def leave(next_pc, n):
+            # IR holds the last instruction the block executed, like the interpreter leaves it
+            lines = writeback()
+            if n:
+                lines.append(f"cpu.ir = {ir}")
+            return lines + [f"return {next_pc}, {n}"]
+
+        def sync(address, instruction, n):
+            # Machine state as the interpreter has it while running the
+            # instruction at address, for code that may raise or read it
+            nonlocal fl_dirty
+            body.extend(writeback())
+            dirty.clear()
+            fl_dirty = False
+            body.append(f"cpu.pc = {address}")
+            body.append(f"cpu.ir = {instruction}")
+            body.append(f"cpu._jit_done = {n}")
+
+        def stale_check(next_pc, n):
+            # A write hit compiled code, possibly this block, so bail out
+            body.append("if cpu._jit_stale:")
+            body.append("    cpu._jit_stale = False")
+            body.extend("    " + line for line in leave(next_pc, n))
+
+        address = start
+        n = 0
+        end = start
+        ir = 0
+
+        while n < JIT_MAX_BLOCK and address < len(ram):
+            instruction = ram[address]
+            execute, operands, length, updates_pc = (
+                self._decoded[address] or self._decode(address)
+            )
+
+            a, b = (operands + (0, 0))[:2]
+
+            # Leave unknown instructions and bad register operands to the
+            # interpreter so they fault there
+            if execute is CPU._TRAP or (
+                instruction not in JIT_IMMEDIATE_B and max(a, b) > 7 or a > 7
+            ):
+                body.extend(leave(address, n))
+                break
+
+            n += 1
+            ir = instruction
+            end = max(end, address + 1 + len(operands), address + length)
+            next_address = address + length
+
+            if instruction in JIT_TEMPLATES:
+                template = JIT_TEMPLATES[instruction]
+                if template:
+                    body.append(template.format(a=a, b=b))
+                if instruction == 0xA7:
+                    fl_dirty = True
+                elif template:
+                    dirty.add(a)
+                    known.pop(a, None)
+                if instruction == 0x82:
+                    known[a] = b
+
+            elif instruction in JIT_BRANCHES:
+                condition = JIT_BRANCHES[instruction]
+                target = known.get(a, f"r{a}")
+                if condition is None:
+                    body.extend(leave(target, n))
+                else:
+                    body.append(f"if {condition}:")
+                    body.extend("    " + line for line in leave(target, n))
+                    body.extend(leave(next_address, n))
+                break
+
+            elif instruction == 0x84:
+                # ST, write hooks (MMU) can fault
+                sync(address, instruction, n)
+                body.append(f"cpu._ram_write(r{a}, r{b})")
+                stale_check(next_address, n)
+
+            elif instruction == 0x45:
+                # PUSH
+                body.append("r7 = (r7 - 1) & 0xFF")
+                dirty.add(7)
+                known.pop(7, None)
+                sync(address, instruction, n)
+                body.append(f"cpu._ram_write(r7, r{a})")
+                stale_check(next_address, n)
+
+            elif instruction == 0x46:
+                # POP
+                body.append("value = ram[r7]")
+                body.append("r7 = (r7 + 1) & 0xFF")
+                body.append(f"r{a} = value")
+                dirty.update((7, a))
+                known.pop(a, None)
+                known.pop(7, None)
+
+            else:
+                # Fall back to the regular handler with the machine state synced
+                name = f"op_{address:02x}"
+                handlers[name] = (instruction, execute is not CPU.dispatch[instruction])
+                sync(address, instruction, n)
+                body.append(f"{name}(cpu{''.join(f', {o}' for o in operands)})")
+
+                if updates_pc or instruction == 0x01:
+                    # CALL / RET / INT / IRET / HLT end the block
+                    body.append(f"return cpu.pc, {n}")
+                    break
+
+                body.append("r0, r1, r2, r3, r4, r5, r6, r7 = reg")
+                body.append("fl = cpu.fl")
+                known.clear()
+                stale_check(next_address, n)
+
+            address = next_address
+        else:
+            # Ran out of block (or RAM), continue in whatever comes next
+            body.extend(leave(address, n))
+
+        if not n:
+            return None
+
+        name = f"block_{start:02x}"
+        source = "\n".join(
+            [
+                f"def {name}(cpu, reg, ram):",
+                "    r0, r1, r2, r3, r4, r5, r6, r7 = reg",
+                "    fl = cpu.fl",
+            ]
+            + ["    " + line for line in body]
+        )
+
+        return name, source, handlers, n, min(end, len(ram))
+
+    @staticmethod
+    def _jit_handler(instruction, wrapped):
+        """
+        Returns the handler a block calls for an instruction it can't inline,
+        wrapped like _decode does for instructions that write IM or IS
+        """
+        handler = CPU.dispatch[instruction]
+        return CPU._updates_interrupt_pending(handler) if wrapped else handler
+
+    def _jit_install(self, start, block, end):
+        """
+        Runs block whenever PC reaches start, until a write to any byte from
+        start up to end invalidates it
+        """
+        # Remember which addresses this block was compiled from
+        self._jit_blocks[start] = block
+        self._jit_ranges[start] = range(start, end)
+        for covered in self._jit_ranges[start]:
+            if not self._jit_cover[covered]:
+                self._jit_cover[covered] = set()
+            self._jit_cover[covered].add(start)
 
-            # Load instruction from RAM at address PC into IR
-            self._read_instruction()
+    def install_blocks(self, blocks):
+        """
+        Replaces all compiled blocks with precompiled ones, {start: (function,
+        end)} as generated by aot.py, and switches the JIT on so they run
 
-            # Print trace if param set
-            if trace_cycle:
-                self._trace()
+        The blocks are dropped like JIT compiled ones when the code they were
+        compiled from is overwritten.
+        """
+        self.jit = True
+        self._jit_reset()
+        for start, (block, end) in blocks.items():
+            self._jit_install(start, block, end)
 
-            # Execute instruction loaded in IR
-            self._execute_instruction()
+    def _jit_invalidate(self, address):
+        """
+        Drops every compiled block that was built from the byte at address
+        """
+        for start in list(self._jit_cover[address]):
+            del self._jit_blocks[start]
+            for covered in self._jit_ranges.pop(start):
+                self._jit_cover[covered].discard(start)
+            self._jit_heat[start] = 0
 
-            # Activate timer interrupt if 1 second has past
-            timer_check = time()
-            if timer_check - timer_start > 1:
-                # INT
-                self.raise_interrupt(self.timer_interrupt_bit)
-                # Reset timer
-                timer_start = time()
+        self._jit_stale = True
 
-            # Sleep 5 ms to keep cpu usage down
-            sleep(0.005)
+    def _jit_reset(self):
+        """
+        Drops all compiled blocks
+        """
+        self._jit_blocks = {}
+        self._jit_ranges = {}
+        self._jit_cover = [()] * 256
+        self._jit_heat = [0] * 256
+        self._jit_stale = False
+        self._jit_done = 0
 
     """
     ******************************************************
@@ -350,6 +1416,12 @@ class CPU:
     ******************************************************
     """
 
+    def _TRAP(self, *operands):
+        """
+        Handles an instruction the CPU doesn't understand
+        """
+        raise CPUFault("Unknown instruction encountered.")
+
     def _NOP(self):
         # Do nothing
         pass
@@ -358,29 +1430,26 @@ class CPU:
         """
         Halts program execution
         """
-        exit()
+        raise Halt()
 
     def _PRA(self, r):
         """
         Prints register r contents as an ASCII character
         """
-        print(chr(self.reg[r]))
+        self.output.write_line(bytes((self.reg[r],)))
 
     def _PRM(self, ra, rb):
         """
         Prints ASCII characters stored in a range between memory address in registerA to registerB
         """
-        string = ""
-        for char_addr in range(self.reg[ra], self.reg[rb] + 1):
-            string += chr(self.ram[char_addr])
-
-        print(string)
+        # Whole range in one write straight from memory
+        self.output.write_line(self.ram[self.reg[ra] : self.reg[rb] + 1])
 
     def _PRN(self, r):
         """
         Prints value stored in register r
         """
-        print(self.reg[r])
+        self.output.write_line(b"%d" % self.reg[r])
 
     def _LD(self, ra, rb):
         """
@@ -398,7 +1467,7 @@ class CPU:
         """
         Stores value from registerB into memory at address stored in registerA
         """
-        self.ram[self.reg[ra]] = self.reg[rb]
+        self._ram_write(self.reg[ra], self.reg[rb])
 
     def _PUSH(self, r, value=None):
         """
@@ -415,10 +1484,10 @@ class CPU:
 
         if value is not None:
             # We want to set a direct value instead of a register
-            self.ram[self.reg[self.spr]] = value
+            self._ram_write(self.reg[self.spr], value)
         else:
             # Copy value from register r to stack at address SP
-            self.ram[self.reg[self.spr]] = self.reg[r]
+            self._ram_write(self.reg[self.spr], self.reg[r])
 
     def _POP(self, r, ret=False):
         """
@@ -446,10 +1515,8 @@ class CPU:
         """
         Pushes PC + 2 onto stack and then jumps to address in register r
         """
-        # Dec SP
-        self.reg[self.spr] -= 1
         # Push next instruction address onto stack
-        self.ram[self.reg[self.spr]] = self.pc + 2
+        self._PUSH(r=None, value=(self.pc + 2) & 0b11111111)
         # Set PC to address stored in register r
         self.pc = self.reg[r]
 
@@ -458,16 +1525,17 @@ class CPU:
         Pops address from previous CALL and stores it in PC
         """
         # Pop ram[SP] into PC
-        self.pc = self.ram[self.reg[self.spr]]
-        # Inc SP
-        self.reg[self.spr] += 1
+        self.pc = self._POP(r=None, ret=True)
 
     def _INT(self, r):
         """
         Issue interrupt number stored in register r
         Sets nth_bit in register IS
         """
-        self.reg[self.isr] = self.set_nth_bit(self.reg[r], 1)
+        self.raise_interrupt(self.reg[r] & 0b111)
+
+        # Handler runs before the next fetch, so continue after this instruction
+        self.pc += 2
 
     def _IRET(self):
         """
@@ -490,6 +1558,11 @@ class CPU:
 
         # Re-enable interrupts
         self.interrupts_enabled = True
+        self._update_interrupt_pending()
+
+        # The interrupt is serviced, devices can raise the next one
+        if self.devices:
+            self._poll_devices()
 
     def _JMP(self, r):
         """
@@ -587,8 +1660,7 @@ class CPU:
         Halts on division by 0
         """
         if self.reg[rb] == 0:
-            print("Cannot divide by 0!")
-            exit()
+            raise CPUFault("Cannot divide by 0!")
         else:
             self.reg[ra] = self.reg[ra] // self.reg[rb]
 
@@ -598,8 +1670,7 @@ class CPU:
         Halts on division by 0
         """
         if self.reg[rb] == 0:
-            print("Cannot divide by 0!")
-            exit()
+            raise CPUFault("Cannot divide by 0!")
         else:
             self.reg[ra] = int(self.reg[ra] % self.reg[rb])
 
@@ -637,7 +1708,7 @@ class CPU:
         """
         Bitwise NOT the value in register r
         """
-        self.reg[r] = ~self.reg[r]
+        self.reg[r] = ~self.reg[r] & 0b11111111
 
     def _ALU_SHL(self, ra, rb):
         """
@@ -667,3 +1738,85 @@ class CPU:
             self.fl = 0b00000100
         else:  # ==
             self.fl = 0b00000001
+
+    """
+    ******************************************************
+    DISPATCH TABLE
+    ******************************************************
+    """
+
+    # Flat opcode -> handler table shared by every CPU instance
+    # ALU and non-ALU instructions live side by side, every other opcode traps
+    dispatch = [_TRAP] * 256
+    # NOP
+    dispatch[0x00] = _NOP
+    # HLT
+    dispatch[0x01] = _HLT
+    # PRA
+    dispatch[0x48] = _PRA
+    # PRM
+    dispatch[0x49] = _PRM
+    # PRN
+    dispatch[0x47] = _PRN
+    # LD
+    dispatch[0x83] = _LD
+    # LDI
+    dispatch[0x82] = _LDI
+    # ST
+    dispatch[0x84] = _ST
+    # PUSH
+    dispatch[0x45] = _PUSH
+    # POP
+    dispatch[0x46] = _POP
+    # CALL
+    dispatch[0x50] = _CALL
+    # RET
+    dispatch[0x11] = _RET
+    # INT
+    dispatch[0x52] = _INT
+    # IRET
+    dispatch[0x13] = _IRET
+    # JMP
+    dispatch[0x54] = _JMP
+    # JLT
+    dispatch[0x58] = _JLT
+    # JGT
+    dispatch[0x57] = _JGT
+    # JEQ
+    dispatch[0x55] = _JEQ
+    # JLE
+    dispatch[0x59] = _JLE
+    # JGE
+    dispatch[0x5A] = _JGE
+    # JNE
+    dispatch[0x56] = _JNE
+    # ADD
+    dispatch[0xA0] = _ALU_ADD
+    # ADDi
+    dispatch[0xA6] = _ALU_ADDi
+    # SUB
+    dispatch[0xA1] = _ALU_SUB
+    # MUL
+    dispatch[0xA2] = _ALU_MUL
+    # DIV
+    dispatch[0xA3] = _ALU_DIV
+    # MOD
+    dispatch[0xA4] = _ALU_MOD
+    # INC
+    dispatch[0x65] = _ALU_INC
+    # DEC
+    dispatch[0x66] = _ALU_DEC
+    # SHL
+    dispatch[0xAC] = _ALU_SHL
+    # SHR
+    dispatch[0xAD] = _ALU_SHR
+    # AND
+    dispatch[0xA8] = _ALU_AND
+    # OR
+    dispatch[0xAA] = _ALU_OR
+    # XOR
+    dispatch[0xAB] = _ALU_XOR
+    # NOT
+    dispatch[0x69] = _ALU_NOT
+    # CMP
+    dispatch[0xA7] = _ALU_CMP
@@ -0,0 +1,113 @@
+"""
+Debugger
+
+Breakpoints and watchpoints for a CPU.
+
+Breakpoints are kept as a 256-bit set (an int, bit n is address n) that the
+debug loop (CPU._execute_debug) tests before every fetch. Memory watchpoints
+catch every write through a CPU write hook, so ST, PUSH, CALL, interrupts and
+device DMA. Register watchpoints compare the watched registers after each
+instruction.
+
+Attaching the debugger switches CPU.run over to the debug loop and adds the
+write hook, detaching undoes both.
+"""
+
+
+class Debugger:
+    def __init__(self, ls8):
+        self.ls8 = ls8
+        # Address sets, bit n set means address n
+        self.breakpoints = 0
+        self.memory_watches = 0
+        # Register set, bit n set means Rn
+        self.register_watches = 0
+        # True while any watchpoint is set
+        self.watching = False
+        # Set after stopping at a breakpoint so the next run can step off it
+        self.resuming = False
+        # Description of the last watchpoint hit
+        self.hit = None
+
+        # Watched writes since the last check
+        self._writes = []
+        # Registers as of the last check
+        self._registers = bytes(ls8.reg)
+
+    def attach(self):
+        """
+        Makes CPU.run stop at this debugger's breakpoints and watchpoints
+        """
+        self.ls8.debugger = self
+        self.ls8.add_write_hook(self._note_write)
+        self._registers = bytes(self.ls8.reg)
+
+    def detach(self):
+        """
+        Returns the CPU to running at full speed
+        """
+        self.ls8.debugger = None
+        self.ls8.remove_write_hook(self._note_write)
+
+    def add_breakpoint(self, address):
+        self.breakpoints |= 1 << (address & 0xFF)
+
+    def remove_breakpoint(self, address):
+        self.breakpoints &= ~(1 << (address & 0xFF))
+
+    def watch_memory(self, address):
+        self.memory_watches |= 1 << (address & 0xFF)
+        self.watching = True
+
+    def unwatch_memory(self, address):
+        self.memory_watches &= ~(1 << (address & 0xFF))
+        self.watching = bool(self.memory_watches or self.register_watches)
+
+    def watch_register(self, r):
+        if not 0 <= r < len(self.ls8.reg):
+            raise ValueError(f"no register R{r}")
+
+        self.register_watches |= 1 << r
+        self.watching = True
+        self._registers = bytes(self.ls8.reg)
+
+    def unwatch_register(self, r):
+        self.register_watches &= ~(1 << r)
+        self.watching = bool(self.memory_watches or self.register_watches)
+
+    def _note_write(self, mar, mdr):
+        """
+        Write hook that notes writes to watched addresses
+        """
+        if self.memory_watches >> mar & 1:
+            self._writes.append((mar, mdr))
+
+    def check(self):
+        """
+        Returns True if a watchpoint was hit since the last check, with a
+        description in self.hit
+        """
+        self.hit = None
+
+        if self._writes:
+            mar, mdr = self._writes[0]
+            self._writes.clear()
+            self.hit = f"write of 0x{mdr:02X} to 0x{mar:02X}"
+
+        reg = self.ls8.reg
+        if reg != self._registers:
+            if self.hit is None:
+                for r in range(len(reg)):
+                    if self.register_watches >> r & 1 and reg[r] != self._registers[r]:
+                        self.hit = f"R{r} changed from 0x{self._registers[r]:02X} to 0x{reg[r]:02X}"
+                        break
+
+            self._registers = bytes(reg)
+
+        return self.hit is not None
+
+    def addresses(self, address_set):
+        """
+        Lists the addresses in a breakpoint or watchpoint set
+        """
+        return [address for address in range(256) if address_set >> address & 1]
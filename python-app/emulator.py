@@ -2,55 +2,259 @@
 
 """Main."""
 
+import argparse
 import sys
 from os import path
-from cpu import CPU
-from keyboard import Keyboard
+from aot import load_compiled
+from cpu import CPU, DEFAULT_CLOCK_HZ, EXIT_BUDGET, EXIT_FAULT
+from debugger import Debugger
+from keyboard import Keyboard, ScriptedKeyboard
+from mmu import MMU
+from profiler import Profiler
+from tracer import TraceBuffer, format_record
 
 
-def print_usage(error: str) -> None:
+DEBUG_HELP = """\
+b ADDR        set a breakpoint          d ADDR      delete a breakpoint
+w ADDR        watch writes to memory    uw ADDR     stop watching memory
+wr N          watch register RN         uwr N       stop watching RN
+s [N]         step N instructions       c           continue
+i             inspect registers         x ADDR [N]  examine N bytes of memory
+k TEXT        type TEXT on the keyboard l           list breakpoints / watches
+q             quit"""
+
+
+def debug_repl(ls8, keyboard):
     """
-    Prints usage statement along with any error if provided
+    Step / continue / inspect prompt for running a program under the debugger
     """
-    if error:
-        print("error: " + error + "\n")
-    print("usage: ls8.py input_file [-d] (debug trace)")
+    debugger = Debugger(ls8)
+    debugger.attach()
+    ls8.attach(keyboard)
 
+    print("LS-8 debugger, h for help")
+    ls8._trace()
 
-if __name__ == "__main__":
-    args = sys.argv
-    args_len = len(args)
-
-    # Valid number of arguments
-    if args_len > 1 and args_len < 4:
-        # Must provide atleast input file
-        input_file = args[1]
-        # Is file valid
-        if path.exists(input_file):
-            # Create instance
-            ls8 = CPU()
-
-            # Initialize keyboard
-            keyboard = Keyboard(ls8)
-
-            # Load program
-            ls8.load(input_file)
-
-            # Connect keyboard (starts polling thread)
-            keyboard.connect()
-
-            # Run without debug trace mode
-            if args_len == 2:
-                ls8.run()
-
-            # Run with debug trace mode
-            elif args_len == 3:
-                if args[2] == "-d":
-                    ls8.run(trace_cycle=True)
+    while True:
+        try:
+            line = input("(ls8) ").split(maxsplit=1)
+        except EOFError:
+            break
+
+        if not line:
+            continue
+
+        command, rest = line[0], line[1] if len(line) > 1 else ""
+        args = rest.split()
+
+        try:
+            if command == "q":
+                break
+            elif command == "h":
+                print(DEBUG_HELP)
+            elif command == "b":
+                debugger.add_breakpoint(int(args[0], 0))
+            elif command == "d":
+                debugger.remove_breakpoint(int(args[0], 0))
+            elif command == "w":
+                debugger.watch_memory(int(args[0], 0))
+            elif command == "uw":
+                debugger.unwatch_memory(int(args[0], 0))
+            elif command == "wr":
+                debugger.watch_register(int(args[0], 0))
+            elif command == "uwr":
+                debugger.unwatch_register(int(args[0], 0))
+            elif command == "k":
+                keyboard.feed(rest)
+            elif command == "l":
+                for name, address_set in (
+                    ("breakpoints", debugger.breakpoints),
+                    ("watched memory", debugger.memory_watches),
+                ):
+                    addresses = debugger.addresses(address_set)
+                    print(f"{name}:", " ".join(f"0x{a:02X}" for a in addresses))
+
+                registers = [r for r in range(8) if debugger.register_watches >> r & 1]
+                print("watched registers:", " ".join(f"R{r}" for r in registers))
+            elif command == "i":
+                print(f"PC {ls8.pc:02X}  FL {ls8.fl:03b}  cycles {ls8.cycles}")
+                print(" ".join(f"R{r} {value:02X}" for r, value in enumerate(ls8.reg)))
+            elif command == "x":
+                start = int(args[0], 0) & 0xFF
+                count = int(args[1], 0) if len(args) > 1 else 16
+                for row in range(start, min(start + count, 256), 16):
+                    values = ls8.memory_view(row, min(row + 16, start + count, 256))
+                    print(f"{row:02X}: " + " ".join(f"{value:02X}" for value in values))
+            elif command in ("s", "c"):
+                if command == "s":
+                    result = ls8.run(max_cycles=int(args[0], 0) if args else 1)
                 else:
-                    print_usage("Invalid flag set")
+                    try:
+                        result = ls8.run()
+                    except KeyboardInterrupt:
+                        print("interrupted")
+                        continue
+
+                if result.reason != EXIT_BUDGET:
+                    print(result.reason + (f": {result.fault}" if result.fault else ""))
+                ls8._trace()
+            else:
+                print(f"unknown command {command}, h for help")
+        except IndexError:
+            print("missing argument")
+        except ValueError as error:
+            print(f"bad argument: {error}")
+
+    debugger.detach()
+
+
+def parse_args():
+    """
+    Parses command line arguments
+    """
+    parser = argparse.ArgumentParser(prog="emulator.py", description="LS-8 emulator")
+    parser.add_argument("input_file", help="program to run (.ls8, .ls8b image, .asm source or aot.py module)")
+    parser.add_argument(
+        "-d",
+        dest="trace",
+        action="store_true",
+        help="debug trace, prints the last instructions executed when the run ends",
+    )
+    parser.add_argument(
+        "--trace-file",
+        metavar="FILE",
+        help="record every instruction to a binary trace file (see tracer.py)",
+    )
+
+    parser.add_argument(
+        "-j", "--jit", action="store_true", help="compile hot code into Python"
+    )
+
+    parser.add_argument(
+        "--timer-cycles",
+        type=int,
+        metavar="N",
+        help="fire the timer interrupt every N cycles instead of every second",
+    )
+
+    parser.add_argument(
+        "--bank-file",
+        metavar="FILE",
+        help="switch banks of FILE into 0x80-0xBF, selected through 0xF5 / 0xF6 (see mmu.py)",
+    )
+
+    parser.add_argument(
+        "--debug",
+        action="store_true",
+        help="run under the debugger (breakpoints, watchpoints, stepping)",
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="profile the run and print a report to stderr",
+    )
+    parser.add_argument(
+        "--profile-json",
+        metavar="FILE",
+        help="profile the run and write the results to FILE as JSON",
+    )
 
+    clock = parser.add_mutually_exclusive_group()
+    clock.add_argument(
+        "-c",
+        "--clock",
+        type=int,
+        default=DEFAULT_CLOCK_HZ,
+        metavar="HZ",
+        help=f"clock rate in instructions per second (default {DEFAULT_CLOCK_HZ})",
+    )
+    clock.add_argument(
+        "-t",
+        "--turbo",
+        action="store_true",
+        help="run unthrottled, as fast as the host allows",
+    )
+
+    return parser, parser.parse_args()
+
+
+if __name__ == "__main__":
+    parser, args = parse_args()
+
+    # Is file valid
+    if not path.exists(args.input_file):
+        parser.error("input_file not found")
+
+    if args.clock <= 0:
+        parser.error("clock rate must be positive")
+
+    if args.timer_cycles is not None and args.timer_cycles <= 0:
+        parser.error("timer cycles must be positive")
+
+    # Create instance
+    ls8 = CPU(
+        clock_hz=None if args.turbo else args.clock,
+        jit=args.jit,
+        timer_cycles=args.timer_cycles,
+    )
+
+    if args.bank_file:
+        try:
+            MMU(ls8, args.bank_file).attach()
+        except (OSError, ValueError) as error:
+            print(error, file=sys.stderr)
+            sys.exit(2)
+
+    if args.profile or args.profile_json:
+        ls8.profiler = Profiler()
+
+    if args.trace_file:
+        trace_file = open(args.trace_file, "wb")
+        ls8.tracer = TraceBuffer(trace_file=trace_file)
+
+    # Load program
+    try:
+        if args.input_file.endswith(".py"):
+            load_compiled(args.input_file).install(ls8)
         else:
-            print_usage("input_file not found")
-    else:
-        print_usage("Invalid number of arguments")
+            ls8.load(args.input_file)
+    except ValueError as error:
+        # Bad program text or assembler source
+        print(error, file=sys.stderr)
+        sys.exit(2)
+
+    if args.debug:
+        # stdin belongs to the prompt, keys are typed with the k command
+        debug_repl(ls8, ScriptedKeyboard(ls8))
+        sys.exit(0)
+
+    # Initialize keyboard
+    keyboard = Keyboard(ls8)
+
+    # Connect keyboard (reads piped input in bulk, otherwise starts the reader thread)
+    keyboard.connect()
+
+    # Run with or without debug trace mode
+    try:
+        result = ls8.run(trace_cycle=args.trace or bool(args.trace_file))
+    finally:
+        if args.trace_file:
+            ls8.tracer.flush()
+            trace_file.close()
+        elif args.trace:
+            ls8.output.flush()
+            for record in ls8.tracer.records():
+                print(format_record(record))
+
+        # Also report when interrupted with Ctrl-C
+        if args.profile:
+            print(ls8.profiler.report(), file=sys.stderr)
+        if args.profile_json:
+            with open(args.profile_json, "w") as profile_file:
+                profile_file.write(ls8.profiler.to_json(indent=2))
+
+    if result.reason == EXIT_FAULT:
+        print(result.fault)
+        ls8._trace()
+        sys.exit(1)
@@ -0,0 +1,281 @@
+"""
+Program images
+
+Binary format for LS-8 programs so they can be loaded without parsing text.
+
+Layout:
+    4 bytes  magic "LS8B"
+    1 byte   format version
+    1 byte   load address
+    1 byte   entry point
+    1 byte   reserved
+    ...      raw program bytes, copied into RAM starting at the load address
+
+Text .ls8 programs are converted automatically and the image is cached next
+to the source (program.ls8 -> program.ls8b). The cache is rebuilt whenever
+the source is newer than the image, or the image can't be read, e.g. because
+it was written by another format VERSION.
+
+Assembler sources (.asm) are assembled in memory with
+programs/compiler/asm.py, without going through a text .ls8 file. Their
+images are cached in a shared directory ($LS8_CACHE_DIR, default
+~/.cache/ls8), in a directory per assembler VERSION, under a hash of the
+source and of the assembler itself, so a source that has been run before
+loads without assembling or even importing the assembler.
+"""
+
+import hashlib
+import importlib.util
+import mmap
+import os
+import re
+import struct
+import sys
+
+MAGIC = b"LS8B"
+VERSION = 1
+
+# Extension used for binary images
+IMAGE_EXTENSION = ".ls8b"
+
+HEADER = struct.Struct("<4sBBBx")
+
+# Extension of assembler sources
+ASM_EXTENSION = ".asm"
+
+ASSEMBLER = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "programs", "compiler", "asm.py"
+)
+
+# asm module, imported on first use
+_assembler = None
+
+# Hash of the assembler source and its VERSION, read on first use
+_assembler_digest = None
+_assembler_version = None
+
+
+def parse_ls8(input_file):
+    """
+    Parses a text .ls8 program into bytes
+    """
+    program = bytearray()
+
+    with open(input_file, "r") as program_file:
+        for line in program_file:
+            # Remove whitespace
+            line = line.strip()
+
+            # Ignore blank lines and lines that start with comments
+            if not line or line[0] == "#":
+                continue
+
+            # All instructions are 1 byte so just
+            # take the first 8 chars and convert
+            # to a binary number
+            program.append(int(line[:8], 2))
+
+    return bytes(program)
+
+
+def assembler():
+    """
+    Returns the assembler module, programs/compiler isn't on the import path
+    """
+    global _assembler
+
+    if _assembler is None:
+        spec = importlib.util.spec_from_file_location("asm", ASSEMBLER)
+        _assembler = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(_assembler)
+
+    return _assembler
+
+
+def asm_cache_dir():
+    """
+    Returns the directory assembled images are cached in
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.environ.get("LS8_CACHE_DIR") or os.path.join(cache_home, "ls8")
+
+
+def cached_asm_path(source):
+    """
+    Returns where the image for an assembler source (bytes) is cached
+
+    Images are kept apart per assembler VERSION, read from its source
+    without importing it. The key covers the assembler's own source as well,
+    so even an edit that didn't bump VERSION never loads stale images.
+    """
+    global _assembler_digest, _assembler_version
+
+    if _assembler_digest is None:
+        with open(ASSEMBLER, "rb") as assembler_file:
+            assembler_source = assembler_file.read()
+
+        version = re.search(rb'^VERSION = "([^"]*)"', assembler_source, re.MULTILINE)
+        _assembler_version = version.group(1).decode() if version else "unversioned"
+        _assembler_digest = hashlib.sha256(assembler_source).digest()
+
+    digest = hashlib.sha256(_assembler_digest + source).hexdigest()
+    return os.path.join(asm_cache_dir(), _assembler_version, digest + IMAGE_EXTENSION)
+
+
+def load_asm(input_file, memory):
+    """
+    Loads an assembler source, from the cache if it was assembled before
+
+    Returns (load_address, entry_point, size)
+    """
+    with open(input_file, "rb") as source_file:
+        source = source_file.read()
+
+    image_file = cached_asm_path(source)
+
+    try:
+        return load_image(image_file, memory)
+    except (FileNotFoundError, ValueError):
+        # Not cached yet, or a damaged image
+        pass
+
+    program = assembler().assemble(source.decode())
+
+    try:
+        os.makedirs(os.path.dirname(image_file), exist_ok=True)
+        write_image(image_file, program)
+    except (OSError, ValueError):
+        # No cache this time, still run the program
+        pass
+
+    return load_bytes(input_file, program, memory)
+
+
+def load_bytes(input_file, program, memory):
+    """
+    Copies a program into the start of memory
+
+    Returns (load_address, entry_point, size)
+    """
+    if len(program) > len(memory):
+        raise ValueError(f"{input_file}: program does not fit in RAM")
+
+    memory[: len(program)] = program
+    return 0, 0, len(program)
+
+
+def write_image(output_file, program, load_address=0, entry_point=0):
+    """
+    Writes program to a binary image
+
+    The image is written to a temporary file and moved into place so that
+    concurrent runs never see a partially written image.
+    """
+    if load_address + len(program) > 256:
+        raise ValueError("program does not fit in RAM")
+
+    temp_file = f"{output_file}.{os.getpid()}.tmp"
+
+    with open(temp_file, "wb") as image_file:
+        image_file.write(HEADER.pack(MAGIC, VERSION, load_address, entry_point))
+        image_file.write(program)
+
+    os.replace(temp_file, output_file)
+
+
+def is_image(input_file):
+    """
+    Checks whether a file is a binary image rather than a text program
+    """
+    with open(input_file, "rb") as program_file:
+        return program_file.read(len(MAGIC)) == MAGIC
+
+
+def load_image(input_file, memory):
+    """
+    Maps a binary image and copies it into memory with a single slice assignment
+
+    Returns (load_address, entry_point, size)
+    """
+    with open(input_file, "rb") as image_file:
+        with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as image:
+            if len(image) < HEADER.size:
+                raise ValueError(f"{input_file}: truncated image header")
+
+            magic, version, load_address, entry_point = HEADER.unpack_from(image)
+
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{input_file}: not an LS-8 image")
+
+            size = len(image) - HEADER.size
+            if load_address + size > len(memory):
+                raise ValueError(f"{input_file}: program does not fit in RAM")
+
+            memory[load_address : load_address + size] = image[HEADER.size :]
+
+    return load_address, entry_point, size
+
+
+def cached_image_path(input_file):
+    """
+    Returns where the image for a text program is cached
+    """
+    image_file = os.path.splitext(input_file)[0] + IMAGE_EXTENSION
+
+    # Never overwrite the source itself
+    if image_file == input_file:
+        image_file += IMAGE_EXTENSION
+
+    return image_file
+
+
+def load_program(input_file, memory):
+    """
+    Loads a binary image or a text program into memory
+
+    Text programs go through the image cache, which is refreshed if the source
+    changed since it was built. Assembler sources are assembled straight into
+    memory through the content hashed cache.
+
+    Returns (load_address, entry_point, size)
+    """
+    if input_file.endswith(ASM_EXTENSION):
+        return load_asm(input_file, memory)
+
+    if is_image(input_file):
+        return load_image(input_file, memory)
+
+    image_file = cached_image_path(input_file)
+
+    try:
+        fresh = os.stat(image_file).st_mtime_ns >= os.stat(input_file).st_mtime_ns
+    except FileNotFoundError:
+        fresh = False
+
+    if fresh:
+        try:
+            return load_image(image_file, memory)
+        except ValueError:
+            # Damaged, or written by another format VERSION, build it again
+            pass
+
+    program = parse_ls8(input_file)
+
+    try:
+        write_image(image_file, program)
+    except OSError:
+        # Can't cache next to the source, just load the parsed program
+        return load_bytes(input_file, program, memory)
+
+    return load_image(image_file, memory)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("usage: image.py infile.ls8 [outfile.ls8b]", file=sys.stderr)
+        sys.exit(1)
+
+    source = sys.argv[1]
+    target = sys.argv[2] if len(sys.argv) == 3 else cached_image_path(source)
+
+    write_image(target, parse_ls8(source))
@@ -2,39 +2,188 @@
 Keyboard
 
 1. Has access to CPU instance so it can call an interrupt, access memory (DMA)
-2. Runs in its own thread to allow for simultaneous execution of CPU cycle and keyboard polling loop
+2. Key presses are queued in a FIFO and handed to the CPU one at a time, the
+   next key is only delivered once the previous keyboard interrupt has been
+   serviced (IRET), so fast typing or piped input never overwrites a key the
+   program hasn't read yet
+3. Input from a terminal is read by a background thread that waits on stdin
+   with a selector, piped input already waiting is read in bulk up front
+4. Under asyncio, read_async() reads input on the event loop instead of a thread
 """
 
+import asyncio
+import os
+import select
+import selectors
 import sys
 import threading
-from time import sleep
+from collections import deque
 
+# Address the current key press is written to
+KEY_ADDRESS = 0xF4
 
-class Keyboard:
-    def __init__(self, ls8):
-        # Get access to ls8 as a 'peripheral'
+# How long the reader thread waits on stdin before checking if it should stop
+SELECT_TIMEOUT = 0.1
+
+# Bytes read from stdin at a time
+READ_SIZE = 4096
+
+# Most input queued up front in bulk mode, the rest is read as the program runs
+BULK_LIMIT = 1 << 20
+
+
+class ScriptedKeyboard:
+    """
+    Feeds queued input to the CPU as key presses
+
+    Nothing runs in the background, call poll() between runs or attach the
+    keyboard to the CPU so it is polled between batches of instructions and
+    after every IRET. A key is only delivered once the previous keyboard
+    interrupt has been serviced.
+    """
+
+    def __init__(self, ls8, data=b""):
         self.ls8 = ls8
         # Interrupt bit of this device
         self.interrupt_bit = 1
-        # Create keyboard polling thread
-        self._keyboard_thread = threading.Thread(target=self._poll)
+        # Key presses waiting to be delivered
+        self._fifo = deque()
+        self.feed(data)
+
+    @property
+    def pending(self):
+        """
+        True while there is input left to deliver
+        """
+        return bool(self._fifo)
+
+    def feed(self, data):
+        """
+        Queues data (str or bytes) to be typed, waking the CPU if it is idle
+        """
+        self._fifo.extend(data.encode() if isinstance(data, str) else bytes(data))
+        if self._fifo:
+            self.ls8.wake()
+
+    def poll(self):
+        """
+        Delivers the next key press if the CPU is ready for it
+        """
+        ls8 = self.ls8
+
+        if not self._fifo or not ls8.interrupts_enabled:
+            return
+
+        # Previous key press not picked up yet
+        if ls8.reg[ls8.isr] >> self.interrupt_bit & 1:
+            return
+
+        ls8.dma_write(KEY_ADDRESS, self._fifo.popleft())
+        ls8.raise_interrupt(self.interrupt_bit)
+
+
+class Keyboard(ScriptedKeyboard):
+    """
+    Types whatever arrives on stdin
+
+    bulk queues all input that is already waiting before the program starts,
+    so scripted input runs at full emulation speed. By default it is used
+    when stdin isn't a terminal. Input that arrives later is still read.
+    """
+
+    def __init__(self, ls8, stdin=None, bulk=None):
+        super().__init__(ls8)
+        self.stdin = stdin if stdin is not None else sys.stdin
+        self.bulk = bulk if bulk is not None else not self.stdin.isatty()
+        # Create keyboard reader thread
+        self._keyboard_thread = threading.Thread(target=self._read)
         # Making thread a daemon will allow for auto cleanup on main program exit
         self._keyboard_thread.daemon = True
+        self._stopping = threading.Event()
 
     def connect(self):
-        # Start thread
+        """
+        Attaches the keyboard to the CPU and starts reading input
+        """
+        self.ls8.attach(self)
+
+        if self.bulk and self._read_waiting():
+            # Already at the end of input
+            return
+
         self._keyboard_thread.start()
 
-    def _poll(self):
-        # Enter keyboard polling loop
-        while True:
-            char = sys.stdin.read(1)  # Read one byte (char)
-            if char:
-                # Set char in memory as an int byte
-                self.ls8.ram[0xF4] = ord(char)
-                # Raise keyboard interrupt
-                self.ls8.raise_interrupt(self.interrupt_bit)
-
-            # Sleep 50 ms to keep cpu usage down
-            # Technically this makes it poll the keyboard at 20hz
-            sleep(0.05)
+    def disconnect(self):
+        """
+        Stops reading input and detaches the keyboard from the CPU
+        """
+        self._stopping.set()
+        self.ls8.detach(self)
+
+    def _read_waiting(self):
+        """
+        Queues input that can be read without blocking, returns True at the
+        end of input
+        """
+        fd = self.stdin.fileno()
+        queued = 0
+
+        while queued < BULK_LIMIT and select.select([fd], [], [], 0)[0]:
+            data = os.read(fd, READ_SIZE)
+            if not data:
+                return True
+
+            self.feed(data)
+            queued += len(data)
+
+        return False
+
+    def _read(self):
+        # Queue input as it arrives, without blocking so the thread can stop
+        fd = self.stdin.fileno()
+
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_READ)
+
+            while not self._stopping.is_set():
+                if not selector.select(SELECT_TIMEOUT):
+                    continue
+
+                data = os.read(fd, READ_SIZE)
+                if not data:
+                    # End of input
+                    break
+
+                self.feed(data)
+
+    async def read_async(self):
+        """
+        Attaches the keyboard to the CPU and queues input as it arrives on the
+        running event loop, for use with CPU.run_async()
+
+        Returns at the end of input.
+        """
+        self.ls8.attach(self)
+        loop = asyncio.get_running_loop()
+        fd = self.stdin.fileno()
+        finished = loop.create_future()
+
+        def readable():
+            data = os.read(fd, READ_SIZE)
+            if data:
+                self.feed(data)
+            elif not finished.done():
+                # End of input
+                finished.set_result(None)
+
+        try:
+            loop.add_reader(fd, readable)
+        except (OSError, ValueError):
+            # Regular files can't be watched, they're all there already
+            self.feed(self.stdin.buffer.read())
+            return
+
+        try:
+            await finished
+        finally:
+            loop.remove_reader(fd)
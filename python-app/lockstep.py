@@ -0,0 +1,417 @@
+"""
+Lockstep engine
+
+Runs many LS-8 machines at once, stepping them together with NumPy.
+
+Every machine is a lane: RAM is an (N, 256) uint8 array, the registers an
+(N, 8) uint8 array, and PC / FL / status are vectors. Each step fetches the
+opcode of every running lane, groups lanes by opcode and applies that
+opcode's handler to the whole group as array operations. Handlers are
+matched to opcodes through CPU.dispatch so both engines share one opcode
+table. Lanes that halt or fault drop out.
+
+Intended for fuzzing and parameter sweeps. Requires numpy.
+"""
+
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    raise ImportError("the lockstep engine requires numpy (pip install numpy)")
+
+import image
+from cpu import CPU, EXIT_BUDGET, EXIT_FAULT, EXIT_HALT
+
+# Lane status values
+RUNNING = 0
+HALTED = 1
+FAULTED = 2
+
+# Result of LockstepCPU.run
+# steps: lockstep cycles executed by this run
+# running / halted / faulted: number of lanes in each state afterwards
+LockstepResult = namedtuple("LockstepResult", ["steps", "running", "halted", "faulted"])
+
+# Index of the lowest set bit for every byte, used to pick the interrupt to service
+LOWEST_BIT = np.array(
+    [(value & -value).bit_length() - 1 if value else 0 for value in range(256)],
+    dtype=np.uint8,
+)
+
+
+class LockstepCPU:
+    """N LS-8 machines stepped together."""
+
+    def __init__(self, lanes, timer_cycles=None):
+        """
+        Construct lanes machines in their power on state.
+
+        timer_cycles fires the timer interrupt every timer_cycles steps on all
+        running lanes. There is no wall clock timer.
+        """
+        self.lanes = lanes
+        self.timer_cycles = timer_cycles
+
+        self.ram = np.zeros((lanes, 256), dtype=np.uint8)
+        self.reg = np.zeros((lanes, 8), dtype=np.uint8)
+
+        # PC is wider than a byte so running off the end of RAM can be detected
+        self.pc = np.zeros(lanes, dtype=np.int16)
+        self.fl = np.zeros(lanes, dtype=np.uint8)
+
+        self.interrupts_enabled = np.ones(lanes, dtype=bool)
+        self.status = np.full(lanes, RUNNING, dtype=np.uint8)
+
+        # Cycles executed per lane
+        self.cycles = np.zeros(lanes, dtype=np.int64)
+
+        # Lockstep cycles executed, drives the timer
+        self.steps = 0
+
+        # Text printed by each lane
+        self.output = [[] for _ in range(lanes)]
+
+        self.imr = 5
+        self.isr = 6
+        self.spr = 7
+
+        # Start address of stack pointer
+        self.reg[:, self.spr] = 0xF4
+
+    def load(self, input_file, lanes=slice(None)):
+        """
+        Loads a program (text .ls8 or image) into the given lanes, all by default
+        """
+        memory = bytearray(256)
+        load_address, entry_point, size = image.load_program(input_file, memory)
+
+        self.ram[lanes, load_address : load_address + size] = np.frombuffer(
+            memory, dtype=np.uint8
+        )[load_address : load_address + size]
+        self.pc[lanes] = entry_point
+
+    def lane_output(self, lane):
+        """
+        Returns everything a lane printed as one string
+        """
+        return "".join(self.output[lane])
+
+    def exit_reason(self, lane):
+        """
+        Returns why a lane stopped, like RunResult.reason
+        """
+        return (EXIT_BUDGET, EXIT_HALT, EXIT_FAULT)[self.status[lane]]
+
+    def run(self, max_cycles):
+        """
+        Steps all lanes until none are running or max_cycles steps have passed
+        """
+        steps = 0
+
+        while steps < max_cycles and self.step():
+            steps += 1
+
+        counts = np.bincount(self.status, minlength=3)
+        return LockstepResult(
+            steps, int(counts[RUNNING]), int(counts[HALTED]), int(counts[FAULTED])
+        )
+
+    def step(self):
+        """
+        Executes one instruction on every running lane
+
+        Returns the number of lanes that executed an instruction
+        """
+        lanes = np.flatnonzero(self.status == RUNNING)
+        if not len(lanes):
+            return 0
+
+        # Running off the end of RAM faults, counted as a cycle like the
+        # interpreter, before a pending interrupt could push the PC
+        overrun = self.pc[lanes] > 0xFF
+        if overrun.any():
+            self.status[lanes[overrun]] = FAULTED
+            self.cycles[lanes[overrun]] += 1
+            lanes = lanes[~overrun]
+
+        self._handle_interrupts(lanes)
+
+        pc = self.pc[lanes]
+
+        ram = self.ram
+        opcodes = ram[lanes, pc]
+        operand_a = ram[lanes, (pc + 1) & 0xFF]
+        operand_b = ram[lanes, (pc + 2) & 0xFF]
+
+        # Group lanes by opcode
+        order = np.argsort(opcodes, kind="stable")
+        counts = np.bincount(opcodes, minlength=256)
+        start = 0
+
+        for opcode in np.flatnonzero(counts):
+            group = order[start : start + counts[opcode]]
+            start += counts[opcode]
+
+            sel = lanes[group]
+            a = operand_a[group]
+            b = operand_b[group]
+
+            # Register operands above R7 fault, like the interpreter
+            if opcode in REGISTER_A:
+                bad = a > 7
+                if opcode in REGISTER_B:
+                    bad |= b > 7
+                if bad.any():
+                    self.status[sel[bad]] = FAULTED
+                    sel, a, b = sel[~bad], a[~bad], b[~bad]
+
+            VECTOR_DISPATCH[opcode](self, sel, a, b)
+
+            # Advance PC on lanes that are still running
+            if not opcode & 0b00010000:
+                still = sel[self.status[sel] == RUNNING]
+                self.pc[still] += 1 + (opcode >> 6)
+
+        self.cycles[lanes] += 1
+        self.steps += 1
+
+        # Activate timer interrupt every timer_cycles steps
+        if self.timer_cycles and self.steps % self.timer_cycles == 0:
+            running = self.status == RUNNING
+            self.reg[running, self.isr] |= 1
+
+        return len(lanes)
+
+    def _handle_interrupts(self, lanes):
+        """
+        Services the lowest pending interrupt on every lane that has one
+        """
+        reg = self.reg
+        masked = reg[lanes, self.imr] & reg[lanes, self.isr]
+        pending = self.interrupts_enabled[lanes] & (masked != 0)
+
+        if not pending.any():
+            return
+
+        sel = lanes[pending]
+        i = LOWEST_BIT[masked[pending]]
+
+        # Disable interrupt handling until this one is serviced
+        self.interrupts_enabled[sel] = False
+
+        # Clear interrupt bit in IS
+        reg[sel, self.isr] &= ~(np.left_shift(1, i).astype(np.uint8))
+
+        # Push PC, FL and R0-R6
+        self._push(sel, self.pc[sel].astype(np.uint8))
+        self._push(sel, self.fl[sel])
+        for r in range(0, 7):
+            self._push(sel, reg[sel, r])
+
+        # Jump to interrupt handler
+        self.pc[sel] = self.ram[sel, 0xF8 + i]
+
+    """
+    ******************************************************
+    VECTOR INSTRUCTION DEFINITIONS
+    ******************************************************
+    """
+
+    def _push(self, sel, values):
+        sp = self.reg[sel, self.spr] - np.uint8(1)
+        self.reg[sel, self.spr] = sp
+        self.ram[sel, sp] = values
+
+    def _pop(self, sel):
+        sp = self.reg[sel, self.spr]
+        values = self.ram[sel, sp]
+        self.reg[sel, self.spr] = sp + np.uint8(1)
+        return values
+
+    def _jump_if(self, sel, a, taken):
+        # Like the interpreter, the register is only read when the jump is taken
+        bad = taken & (a > 7)
+        if bad.any():
+            self.status[sel[bad]] = FAULTED
+            sel, a, taken = sel[~bad], a[~bad], taken[~bad]
+
+        target = self.reg[sel, np.minimum(a, 7)]
+        self.pc[sel] = np.where(taken, target, self.pc[sel] + 2)
+
+    def _print(self, sel, texts):
+        for lane, text in zip(sel.tolist(), texts):
+            self.output[lane].append(text + "\n")
+
+    def _TRAP(self, sel, a, b):
+        self.status[sel] = FAULTED
+
+    def _NOP(self, sel, a, b):
+        pass
+
+    def _HLT(self, sel, a, b):
+        self.status[sel] = HALTED
+
+    def _PRA(self, sel, a, b):
+        self._print(sel, [chr(value) for value in self.reg[sel, a].tolist()])
+
+    def _PRM(self, sel, a, b):
+        starts = self.reg[sel, a].tolist()
+        ends = self.reg[sel, b].tolist()
+        self._print(
+            sel,
+            [
+                self.ram[lane, start : end + 1].tobytes().decode("latin-1")
+                for lane, start, end in zip(sel.tolist(), starts, ends)
+            ],
+        )
+
+    def _PRN(self, sel, a, b):
+        self._print(sel, [str(value) for value in self.reg[sel, a].tolist()])
+
+    def _LD(self, sel, a, b):
+        self.reg[sel, a] = self.ram[sel, self.reg[sel, b]]
+
+    def _LDI(self, sel, a, b):
+        self.reg[sel, a] = b
+
+    def _ST(self, sel, a, b):
+        self.ram[sel, self.reg[sel, a]] = self.reg[sel, b]
+
+    def _PUSH(self, sel, a, b):
+        # SP is decremented first so PUSH R7 pushes the new SP
+        sp = self.reg[sel, self.spr] - np.uint8(1)
+        self.reg[sel, self.spr] = sp
+        self.ram[sel, sp] = self.reg[sel, a]
+
+    def _POP(self, sel, a, b):
+        values = self._pop(sel)
+        self.reg[sel, a] = values
+
+    def _CALL(self, sel, a, b):
+        self._push(sel, ((self.pc[sel] + 2) & 0xFF).astype(np.uint8))
+        self.pc[sel] = self.reg[sel, a]
+
+    def _RET(self, sel, a, b):
+        self.pc[sel] = self._pop(sel)
+
+    def _INT(self, sel, a, b):
+        bits = np.left_shift(1, self.reg[sel, a] & 7).astype(np.uint8)
+        self.reg[sel, self.isr] |= bits
+        self.pc[sel] += 2
+
+    def _IRET(self, sel, a, b):
+        for r in range(6, -1, -1):
+            self.reg[sel, r] = self._pop(sel)
+        self.fl[sel] = self._pop(sel)
+        self.pc[sel] = self._pop(sel)
+        self.interrupts_enabled[sel] = True
+
+    def _JMP(self, sel, a, b):
+        self.pc[sel] = self.reg[sel, a]
+
+    def _JEQ(self, sel, a, b):
+        self._jump_if(sel, a, (self.fl[sel] & 0b00000001) != 0)
+
+    def _JGT(self, sel, a, b):
+        self._jump_if(sel, a, (self.fl[sel] & 0b00000010) != 0)
+
+    def _JLT(self, sel, a, b):
+        self._jump_if(sel, a, (self.fl[sel] & 0b00000100) != 0)
+
+    def _JLE(self, sel, a, b):
+        self._jump_if(sel, a, (self.fl[sel] & 0b00000101) != 0)
+
+    def _JGE(self, sel, a, b):
+        self._jump_if(sel, a, (self.fl[sel] & 0b00000011) != 0)
+
+    def _JNE(self, sel, a, b):
+        # Same as the interpreter: jump unless FL is exactly "equal"
+        self._jump_if(sel, a, (self.fl[sel] ^ 0b00000001) != 0)
+
+    # uint8 arithmetic wraps, matching the interpreter's & 0b11111111
+
+    def _ALU_ADD(self, sel, a, b):
+        self.reg[sel, a] = self.reg[sel, a] + self.reg[sel, b]
+
+    def _ALU_ADDi(self, sel, a, b):
+        self.reg[sel, a] = self.reg[sel, a] + b
+
+    def _ALU_SUB(self, sel, a, b):
+        self.reg[sel, a] = self.reg[sel, a] - self.reg[sel, b]
+
+    def _ALU_MUL(self, sel, a, b):
+        self.reg[sel, a] = self.reg[sel, a] * self.reg[sel, b]
+
+    def _divide(self, sel, a, b, operation):
+        divisor = self.reg[sel, b]
+
+        # Division by 0 faults
+        zero = divisor == 0
+        if zero.any():
+            self.status[sel[zero]] = FAULTED
+            sel, a, divisor = sel[~zero], a[~zero], divisor[~zero]
+
+        self.reg[sel, a] = operation(self.reg[sel, a], divisor)
+
+    def _ALU_DIV(self, sel, a, b):
+        self._divide(sel, a, b, np.floor_divide)
+
+    def _ALU_MOD(self, sel, a, b):
+        self._divide(sel, a, b, np.remainder)
+
+    def _ALU_INC(self, sel, a, b):
+        self.reg[sel, a] = self.reg[sel, a] + np.uint8(1)
+
+    def _ALU_DEC(self, sel, a, b):
+        self.reg[sel, a] = self.reg[sel, a] - np.uint8(1)
+
+    def _ALU_AND(self, sel, a, b):
+        self.reg[sel, a] = self.reg[sel, a] & self.reg[sel, b]
+
+    def _ALU_OR(self, sel, a, b):
+        self.reg[sel, a] = self.reg[sel, a] | self.reg[sel, b]
+
+    def _ALU_XOR(self, sel, a, b):
+        self.reg[sel, a] = self.reg[sel, a] ^ self.reg[sel, b]
+
+    def _ALU_NOT(self, sel, a, b):
+        self.reg[sel, a] = ~self.reg[sel, a]
+
+    def _ALU_SHL(self, sel, a, b):
+        # Shifting by 8 or more clears the register, like the interpreter
+        shift = self.reg[sel, b].astype(np.int64)
+        shifted = (self.reg[sel, a].astype(np.int64) << np.minimum(shift, 8)) & 0xFF
+        self.reg[sel, a] = shifted
+
+    def _ALU_SHR(self, sel, a, b):
+        shift = self.reg[sel, b].astype(np.int64)
+        self.reg[sel, a] = self.reg[sel, a].astype(np.int64) >> np.minimum(shift, 8)
+
+    def _ALU_CMP(self, sel, a, b):
+        left = self.reg[sel, a]
+        right = self.reg[sel, b]
+        self.fl[sel] = np.where(
+            left > right, 0b00000010, np.where(left < right, 0b00000100, 0b00000001)
+        )
+
+
+# Vector handler for every opcode, matched by name to CPU.dispatch
+VECTOR_DISPATCH = [getattr(LockstepCPU, handler.__name__) for handler in CPU.dispatch]
+
+# Conditional jumps, which only read their register when the jump is taken
+# and check it themselves
+CONDITIONAL_JUMPS = {0x55, 0x56, 0x57, 0x58, 0x59, 0x5A}
+
+# Opcodes whose operands are registers, which fault above R7
+# Operand B of LDI and ADDi is an immediate, PRM reads two registers
+REGISTER_A = {
+    opcode
+    for opcode, handler in enumerate(CPU.dispatch)
+    if handler is not CPU._TRAP and opcode >> 6 and opcode not in CONDITIONAL_JUMPS
+}
+REGISTER_B = {
+    opcode
+    for opcode in REGISTER_A
+    if (opcode >> 6 == 2 or opcode == 0x49) and opcode not in (0x82, 0xA6)
+}
@@ -0,0 +1,169 @@
+"""
+Memory management unit
+
+Bank switching for data that doesn't fit in 256 bytes. A window of the
+address space, 0x80-0xBF by default, shows one bank of a file at a time. The
+program picks the bank through the bank select register in the reserved
+range: the high byte of the bank number goes to 0xF6, then writing the low
+byte to 0xF5 switches. 0xF7 stays reserved.
+
+The file is mapped with mmap, so a large dataset is only paged in as its
+banks are used. RAM always holds the selected bank in the window, so fetch,
+LD, POP, the decode cache and the JIT read it like any other memory, and
+writes into the window (ST, PUSH, DMA, CPU.load) go through to the file.
+
+Attaching adds a write hook to the CPU (CPU.add_write_hook), so the MMU and
+the debugger can be attached together. Attach before loading the program:
+
+    mmu = MMU(ls8, "dataset.bin")
+    mmu.attach()
+    ls8.load("program.ls8")
+
+Snapshots hold the window like the rest of RAM. Restoring one writes it back
+to the bank that was selected, other banks keep their current contents.
+"""
+
+import mmap
+import os
+
+from cpu import CPUFault
+
+# Bank select register, writing the low byte switches banks
+BANK_SELECT_LOW = 0xF5
+BANK_SELECT_HIGH = 0xF6
+
+# Address space banks are switched into
+WINDOW_START = 0x80
+WINDOW_SIZE = 0x40
+
+
+class MMU:
+    def __init__(
+        self,
+        ls8,
+        bank_file,
+        window_start=WINDOW_START,
+        window_size=WINDOW_SIZE,
+        banks=None,
+        writable=True,
+    ):
+        """
+        Maps bank_file as banks of window_size bytes each
+
+        banks creates or (sparsely) grows the file to hold at least that many
+        banks. Without writable the file is opened read only and writes to
+        the window only last until the bank is switched out.
+        """
+        if window_size <= 0 or not 0 <= window_start <= BANK_SELECT_LOW - window_size:
+            raise ValueError("bank window must lie below the bank select register")
+
+        self.ls8 = ls8
+        self.window = range(window_start, window_start + window_size)
+        # Selected bank, and what to add to a window address to get its file offset
+        self.bank = 0
+        self._base = -window_start
+
+        if writable:
+            fd = os.open(bank_file, os.O_RDWR | (os.O_CREAT if banks else 0), 0o644)
+        else:
+            fd = os.open(bank_file, os.O_RDONLY)
+
+        try:
+            size = os.fstat(fd).st_size
+            if banks is not None and size < banks * window_size:
+                if not writable:
+                    raise ValueError(f"{bank_file}: holds fewer than {banks} banks")
+                size = banks * window_size
+                os.ftruncate(fd, size)
+
+            if size < window_size:
+                raise ValueError(f"{bank_file}: smaller than a bank")
+
+            self.banks = size // window_size
+            self.memory = mmap.mmap(
+                fd,
+                self.banks * window_size,
+                access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_COPY,
+            )
+        finally:
+            os.close(fd)
+
+    def attach(self):
+        """
+        Installs the MMU in the CPU and maps in the bank the bank select
+        register names
+        """
+        ls8 = self.ls8
+        bank = self._selected()
+        if bank >= self.banks:
+            raise ValueError(f"no bank {bank}")
+
+        ls8.add_write_hook(self._bank_write)
+        ls8.mmu = self
+        self.select(bank)
+
+    def detach(self):
+        """
+        Removes the MMU, the window keeps the bank that was selected
+        """
+        ls8 = self.ls8
+        ls8.mmu = None
+        ls8.remove_write_hook(self._bank_write)
+
+    def close(self):
+        """
+        Detaches the MMU and unmaps the file
+        """
+        if self.ls8.mmu is self:
+            self.detach()
+        self.memory.close()
+
+    def _selected(self):
+        ram = self.ls8.ram
+        return ram[BANK_SELECT_LOW] | ram[BANK_SELECT_HIGH] << 8
+
+    def _bank_write(self, mar, mdr):
+        """
+        Write hook that writes the window through to the selected bank and
+        switches banks when the bank select register is written
+
+        Runs before the write lands, so selecting a bank out of range faults
+        with the register still naming the bank that is mapped in
+        """
+        if mar in self.window:
+            self.memory[self._base + mar] = mdr
+        elif mar == BANK_SELECT_LOW:
+            self.select(mdr | self.ls8.ram[BANK_SELECT_HIGH] << 8)
+
+    def select(self, bank):
+        """
+        Maps bank into the window
+        """
+        if not 0 <= bank < self.banks:
+            raise CPUFault("Bank out of range.")
+
+        size = len(self.window)
+        offset = bank * size
+        self.bank = bank
+        self._base = offset - self.window.start
+
+        self.ls8.ram[self.window.start : self.window.stop] = self.memory[offset : offset + size]
+        # Code may run from the window, forget what was decoded from the old bank
+        self.ls8._forget(self.window)
+
+    def sync(self):
+        """
+        Writes the window to the bank the bank select register names, after
+        RAM was changed without going through the write hook (CPU.load,
+        CPU.restore)
+        """
+        bank = self._selected()
+        if bank >= self.banks:
+            raise ValueError(f"no bank {bank}")
+
+        size = len(self.window)
+        self.bank = bank
+        self._base = bank * size - self.window.start
+        self.memory[bank * size : (bank + 1) * size] = self.ls8.ram[
+            self.window.start : self.window.stop
+        ]
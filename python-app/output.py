@@ -0,0 +1,71 @@
+"""
+Output device
+
+Buffers everything the CPU prints (PRN, PRA, PRM) and writes it to a sink in
+bulk instead of calling print() per instruction.
+
+The buffer is flushed when it holds flush_lines lines, between batches of
+instructions in CPU.run, when a run ends, or on demand with flush().
+
+Sinks can be text (sys.stdout, StringIO, a file opened in text mode) or
+binary (BytesIO, a file opened in "wb" mode, an asyncio StreamWriter).
+Without a sink the output goes to whatever sys.stdout is at flush time.
+"""
+
+import io
+import sys
+
+# Default number of buffered lines that forces a flush
+FLUSH_LINES = 256
+
+
+class OutputDevice:
+    def __init__(self, sink=None, flush_lines=FLUSH_LINES):
+        # Where output ends up, None means sys.stdout
+        self.sink = sink
+        self.flush_lines = flush_lines
+        # Pending output bytes
+        self.buffer = bytearray()
+        self._lines = 0
+
+    def write_line(self, data):
+        """
+        Buffers data (bytes-like) followed by a newline
+        """
+        self.buffer += data
+        self.buffer += b"\n"
+
+        self._lines += 1
+        if self._lines >= self.flush_lines:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes everything buffered to the sink in one go
+        """
+        if not self.buffer:
+            return
+
+        sink = self.sink if self.sink is not None else sys.stdout
+
+        # Bytes are characters 0-255, the same as chr() on each byte
+        if isinstance(sink, io.TextIOBase):
+            sink.write(self.buffer.decode("latin-1"))
+        else:
+            sink.write(bytes(self.buffer))
+
+        # StreamWriters buffer until drained instead
+        if hasattr(sink, "flush"):
+            sink.flush()
+
+        self.buffer.clear()
+        self._lines = 0
+
+    async def drain(self):
+        """
+        Flushes, then waits until an asyncio sink has written everything out
+        """
+        self.flush()
+
+        if hasattr(self.sink, "drain"):
+            await self.sink.drain()
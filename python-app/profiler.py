@@ -0,0 +1,127 @@
+"""
+Profiler
+
+Collects what a CPU spends its time on: how often each opcode runs, which
+addresses are hot, and how much host time each instruction handler and the
+interrupt dispatcher take.
+
+Profiling runs through its own copy of the interpreter loop
+(CPU._execute_profiled), picked by CPU.run only while a profiler is
+installed:
+
+    profiler = Profiler()
+    ls8.profiler = profiler
+    ls8.run()
+    print(profiler.report())
+"""
+
+import json
+
+from cpu import CPU
+
+# Rows shown per table in the text report
+REPORT_ROWS = 16
+
+
+def opcode_name(opcode):
+    """
+    Returns the mnemonic for an opcode, derived from its handler name
+    """
+    handler = CPU.dispatch[opcode]
+    if handler is CPU._TRAP:
+        return f"0x{opcode:02X}"
+    return handler.__name__.replace("_ALU_", "").strip("_").upper()
+
+
+class Profiler:
+    def __init__(self):
+        # Executions per opcode
+        self.opcodes = [0] * 256
+        # Instructions fetched from each address
+        self.addresses = [0] * 256
+        # Host seconds spent in each opcode's handler
+        self.handler_time = [0.0] * 256
+        # Interrupts dispatched and host seconds spent dispatching them
+        self.interrupts = 0
+        self.interrupt_time = 0.0
+
+    def reset(self):
+        """
+        Clears everything collected so far
+        """
+        self.__init__()
+
+    def handlers(self):
+        """
+        Returns (handler name, calls, seconds) for every handler that ran,
+        slowest in total first
+        """
+        rows = [
+            (CPU.dispatch[opcode].__name__, self.opcodes[opcode], self.handler_time[opcode])
+            for opcode in range(256)
+            if self.opcodes[opcode]
+        ]
+        if self.interrupts:
+            rows.append(("_handle_interrupts", self.interrupts, self.interrupt_time))
+
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+    def to_dict(self):
+        """
+        Returns the profile as a JSON friendly dict
+        """
+        return {
+            "instructions": sum(self.opcodes),
+            "opcodes": {
+                opcode_name(opcode): count
+                for opcode, count in sorted(
+                    enumerate(self.opcodes), key=lambda item: item[1], reverse=True
+                )
+                if count
+            },
+            "addresses": {
+                f"0x{address:02X}": count
+                for address, count in sorted(
+                    enumerate(self.addresses), key=lambda item: item[1], reverse=True
+                )
+                if count
+            },
+            "handlers": {
+                name: {"calls": calls, "seconds": seconds}
+                for name, calls, seconds in self.handlers()
+            },
+        }
+
+    def to_json(self, **kwargs):
+        """
+        Returns the profile as a JSON string
+        """
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def report(self, rows=REPORT_ROWS):
+        """
+        Returns the profile as text tables, most significant entries first
+        """
+        total = sum(self.opcodes) or 1
+        lines = [f"{sum(self.opcodes)} instructions", "", f"{'opcode':<8} {'count':>12} {'%':>6}"]
+
+        for opcode, count in sorted(
+            enumerate(self.opcodes), key=lambda item: item[1], reverse=True
+        )[:rows]:
+            if count:
+                lines.append(f"{opcode_name(opcode):<8} {count:>12} {100 * count / total:>6.1f}")
+
+        lines += ["", f"{'address':<8} {'hits':>12} {'%':>6}"]
+
+        for address, count in sorted(
+            enumerate(self.addresses), key=lambda item: item[1], reverse=True
+        )[:rows]:
+            if count:
+                lines.append(f"0x{address:02X}     {count:>12} {100 * count / total:>6.1f}")
+
+        lines += ["", f"{'handler':<20} {'calls':>12} {'seconds':>9} {'ns/call':>9}"]
+
+        for name, calls, seconds in self.handlers()[:rows]:
+            lines.append(f"{name:<20} {calls:>12} {seconds:>9.4f} {1e9 * seconds / calls:>9.0f}")
+
+        return "\n".join(lines)
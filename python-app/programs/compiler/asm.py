@@ -13,10 +13,20 @@
 #  DB 0x0a   ; a hex byte
 #  DB 12   ; a decimal byte
 #  DB 0b0001 ; a binary byte
+#
+# Can also be imported:
+#
+#  from asm import assemble
+#  program = assemble(source)   # bytes, ready to copy into RAM
+#
+# -O (or optimize=True) runs a peephole pass over the code, see peephole()
 
 import sys
 import re
 
+# Bumped whenever the machine code produced for a source may change
+VERSION = "4.1"
+
 # Opcodes
 OPCODES = {
     "ADD":  {"type": 2, "code": "10100000"},
@@ -57,6 +67,12 @@ OPCODES = {
     "XOR":  {"type": 2, "code": "10101011"},
 }
 
+# Opcode byte values
+OPCODE_BYTES = {name: int(info["code"], 2) for name, info in OPCODES.items()}
+
+# Execution never continues with the instruction after these
+NO_FALLTHROUGH = {OPCODE_BYTES[name] for name in ("HLT", "JMP", "RET", "IRET")}
+
 # Regex for matching lines
 # Capturing groups: label, opcode, operandA, operandB
 REGEX = r"(?:(\w+?):)?\s*(?:(\w+)\s*(?:(\w+)(?:\s*,\s*(\w+))?)?)?"
@@ -65,10 +81,66 @@ REGEX = r"(?:(\w+?):)?\s*(?:(\w+)\s*(?:(\w+)(?:\s*,\s*(\w+))?)?)?"
 REGEX_DS = r"(?:(\w+?):)?\s*DS\s*(.+)"  # insensitive
 REGEX_DB = r"(?:(\w+?):)?\s*DB\s*(.+)"  # insensitive
 
+# Regex for register operands
+REGEX_REG = r"R([0-7])"
+
+# Compiled once, not per line
+LINE_RE = re.compile(REGEX)
+DS_RE = re.compile(REGEX_DS, re.IGNORECASE)
+DB_RE = re.compile(REGEX_DB, re.IGNORECASE)
+REG_RE = re.compile(REGEX_REG)
+
+
+class AssemblyError(ValueError):
+    """
+    Raised for errors in the source, status is the CLI exit code
+    """
+
+    def __init__(self, message, status=1):
+        super().__init__(message)
+        self.status = status
+
+
+class Assembly:
+    """
+    Output of pass1
+
+    code: machine code, with 0 wherever a symbol still has to be filled in
+    sym: label -> address
+    fixups: (offset, symbol, line_num) for every symbol reference in code
+    comments: offset -> comment for the byte at that offset in .ls8 output
+    labels: (offset, label) in source order, for .ls8 output
+    items: (offset, size, is_code, line_num) for every instruction and DS / DB
+    """
+
+    def __init__(self):
+        self.code = bytearray()
+        self.sym = {}
+        self.fixups = []
+        self.comments = {}
+        self.labels = []
+        self.items = []
+
+
+class Item:
+    """
+    One instruction or DS / DB while the peephole pass rewrites the code
+    """
+
+    def __init__(self, data, is_code, line_num):
+        self.data = data
+        self.is_code = is_code
+        self.line_num = line_num
+        # Labels pointing at this item
+        self.labels = []
+        # Offset within the item -> (symbol, line_num) / comment
+        self.fixups = {}
+        self.comments = {}
+
 
 def parse_commandline(argv):
     """
-    Usage: asm.py [inputfile] [outputfile]
+    Usage: asm.py [-O] [inputfile] [outputfile]
     """
 
     if len(argv) == 1:
@@ -84,7 +156,7 @@ def parse_commandline(argv):
         outputfile = argv[2]
 
     else:
-        print("usage: asm.py [infile.asm] [outfile.ls8]", file=sys.stderr)
+        print("usage: asm.py [-O] [infile.asm] [outfile.ls8]", file=sys.stderr)
         sys.exit(1)
 
     return inputfile, outputfile
@@ -129,129 +201,99 @@ def p8(v):
     return "{:08b}".format(v)
 
 
-def pass1(inputfile, sym, code):
+def pass1(inputfile, asm):
     """
     Pass 1
 
-    * Read the source code lines
+    * Read the source code lines, one at a time
     * Parse labels, opcodes, and operands
     * Record label offsets
-    * Emit machine code
+    * Emit machine code, recording a fixup for every symbol reference
     """
 
     # Source line number
     line_num = 0
 
-    # Current code address (for labels)
-    addr = 0
+    code = asm.code
+    comments = asm.comments
 
-    def get_reg(op, fatal=True):
+    def get_reg(op):
         """Get a register number from a string, e.g. "R2" -> 2"""
 
-        nonlocal line_num
-
-        m = re.match(r"R([0-7])", op)
+        m = REG_RE.match(op)
 
         if m is None:
-            if fatal:
-                print(f"Line {line_num}: unknown register {op}",
-                      file=sys.stderr)
-                sys.exit(1)
-            else:
-                return None
+            raise AssemblyError(f"Line {line_num}: unknown register {op}", 1)
 
         return int(m.group(1))
 
-    def out0(opcode, op_a, op_b, machine_code):
+    def out0(opcode, op_a, op_b):
         """Handle opcodes with zero operands"""
 
-        nonlocal addr
-
-        code.append(f"{machine_code} # {opcode}")
-        addr += 1
+        comments[len(code)] = opcode
+        code.append(OPCODE_BYTES[opcode])
 
-    def out1(opcode, op_a, op_b, machine_code):
+    def out1(opcode, op_a, op_b):
         """Handle opcodes with one operand"""
 
-        nonlocal addr
-
         reg_a = get_reg(op_a)
-        code.append(f"{machine_code} # {opcode} {op_a}")
-        code.append(p8(reg_a))
-        addr += 2
+        comments[len(code)] = f"{opcode} {op_a}"
+        code.append(OPCODE_BYTES[opcode])
+        code.append(reg_a)
 
-    def out2(opcode, op_a, op_b, machine_code):
+    def out2(opcode, op_a, op_b):
         """Handle opcodes with two operands"""
 
-        nonlocal addr
-
         reg_a = get_reg(op_a)
         reg_b = get_reg(op_b)
 
-        code.append(f"{machine_code} # {opcode} {op_a},{op_b}")
-        code.append(p8(reg_a))
-        code.append(p8(reg_b))
+        comments[len(code)] = f"{opcode} {op_a},{op_b}"
+        code.append(OPCODE_BYTES[opcode])
+        code.append(reg_a)
+        code.append(reg_b)
 
-        addr += 3
-
-    def out8(opcode, op_a, op_b, machine_code):
+    def out8(opcode, op_a, op_b):
         """Handle LDI opcode (type 8)"""
 
-        nonlocal addr
-
         reg_a = get_reg(op_a)
 
+        comments[len(code)] = f"{opcode} {op_a},{op_b}"
+        code.append(OPCODE_BYTES[opcode])
+        code.append(reg_a)
+
         try:
-            val_b = int(op_b, 0)
-            out_b = p8(val_b)
+            code.append(int(op_b, 0) & 0xFF)
 
         except ValueError:
-            # If it's not a value, it might be a symbol
-            out_b = f"sym:{op_b}"
-
-        code.append(f"{machine_code} # {opcode} {op_a},{op_b}")
-        code.append(p8(reg_a))
-        code.append(out_b)
-
-        addr += 3
+            # If it's not a value, it might be a symbol, filled in by pass 2
+            asm.fixups.append((len(code), op_b, line_num))
+            code.append(0)
 
     def handle_ds(line):
         """
         Handle DS pseudo-opcode
         """
 
-        nonlocal addr
-
-        m = re.match(REGEX_DS, line, re.IGNORECASE)
+        m = DS_RE.match(line)
 
         if m is None or m.group(2) is None:
-            print(f"line {line_num}: missing argument to DS", file=sys.stderr)
-            sys.exit(2)
+            raise AssemblyError(f"line {line_num}: missing argument to DS", 2)
 
         data = m.group(2)
 
-        for i in range(len(data)):
-            print_char = data[i]
-
-            if print_char == ' ':
-                print_char = '[space]'
-
-            code.append(f"{p8(ord(data[i]))} # {print_char}")
-
-        addr += len(data)
+        for char in data:
+            comments[len(code)] = "[space]" if char == " " else char
+            code.append(ord(char) & 0xFF)
 
     def handle_db(line):
         """
         Handle the DB pseudo-opcode
         """
 
-        nonlocal addr
-
-        m = re.match(REGEX_DB, line, re.IGNORECASE)
+        m = DB_RE.match(line)
 
         if m is None or m.group(2) is None:
-            print(f"line {line}: missing argument to DB", file=sys.stderr)
-            sys.exit(2)
+            raise AssemblyError(f"line {line_num}: missing argument to DB", 2)
 
         data = m.group(2)
 
@@ -259,16 +301,11 @@ def pass1(inputfile, sym, code):
             val = int(data, 0)
 
         except ValueError:
-            print(f"line {line_num}: invalid integer argument to DB",
-                  file=sys.stderr)
-            sys.exit(2)
+            raise AssemblyError(f"line {line_num}: invalid integer argument to DB", 2)
 
         # Force to byte size
-        val &= 0xff
-
-        code.append(f"{p8(val)} # {data}")
-
-        addr += 1
+        comments[len(code)] = data
+        code.append(val & 0xFF)
 
     def check_ops(opcode, op_a, op_b):
         """Check operands for sanity with a particular opcode"""
@@ -276,18 +313,13 @@ def pass1(inputfile, sym, code):
         def check_ops_count(desired, found):
             # Makes sure we have right operand count
             if found < desired:
-                print(f"Line {line_num}: missing operand to {opcode}",
-                      file=sys.stderr)
-                sys.exit(1)
+                raise AssemblyError(f"Line {line_num}: missing operand to {opcode}", 1)
             elif found > desired:
-                print(f"Line {line_num}: unexpected operand to {opcode}",
-                      file=sys.stderr)
-                sys.exit(1)
+                raise AssemblyError(f"Line {line_num}: unexpected operand to {opcode}", 1)
 
         # Make sure we know this opcode at all
         if opcode not in OPCODES:
-            print(f"line {line_num}: unknown opcode {opcode}", file=sys.stderr)
-            sys.exit(2)
+            raise AssemblyError(f"line {line_num}: unknown opcode {opcode}", 2)
 
         op_type = OPCODES[opcode]["type"]
 
@@ -327,25 +359,22 @@ def pass1(inputfile, sym, code):
         line = line.strip()
 
         # Ignore blank lines
-        if input == '':
+        if line == '':
             continue
 
-        # print(line)  # debug
-
-        m = re.match(REGEX, line)
+        m = LINE_RE.match(line)
 
         if m is not None:
             label, opcode, op_a, op_b = normalize_line(m.groups())
 
-            # print(label, opcode, op_a, op_b)  # debug
-
             # Track label address
             if label is not None:
-                sym[label] = addr
-                # print(f"Label {label}: {addr}")  # debug
-                code.append(f'# {label} (address {addr}):')
+                asm.sym[label] = len(code)
+                asm.labels.append((len(code), label))
 
             if opcode is not None:
+                start = len(code)
+
                 if opcode == 'DS':
                     handle_ds(line)
                 elif opcode == 'DB':
@@ -355,50 +384,250 @@ def pass1(inputfile, sym, code):
                     check_ops(opcode, op_a, op_b)
 
                     # Handle opcodes
-                    op_info = OPCODES[opcode]
-                    handler = type_f[op_info["type"]]
-                    handler(opcode, op_a, op_b, op_info["code"])
+                    type_f[OPCODES[opcode]["type"]](opcode, op_a, op_b)
+
+                asm.items.append(
+                    (start, len(code) - start, opcode not in ('DS', 'DB'), line_num)
+                )
         else:
-            print(f"No match: {input}", file=sys.stderr)
-            sys.exit(3)
+            raise AssemblyError(f"No match: {line}", 3)
+
 
+def peephole(asm):
+    """
+    Optional pass between pass 1 and pass 2, rewrites code to run in fewer cycles
+
+    * Drop NOPs
+    * Drop unlabeled code after HLT, JMP, RET and IRET, it can't be reached
+    * Merge runs of INC / DEC / ADDI on a register into a single ADDI
+    * Fold INC / DEC / ADDI into a preceding LDI of the same register
+
+    Instructions are only removed or merged, never reordered, and labels,
+    symbol references and listing comments move with the code. Programs that
+    jump to code or point at data by numeric address instead of by label
+    can't be optimized.
 
-def pass2(outputfile, sym, code):
+    Returns a report dict: bytes and cycles (instructions) saved, and a
+    description of every rewrite.
     """
-    Output the code, substituting in any symbols.
+
+    fixups = {offset: (s, line_num) for offset, s, line_num in asm.fixups}
+    labels = {}
+    for offset, label in asm.labels:
+        labels.setdefault(offset, []).append(label)
+
+    # Split the code into items, with a sentinel holding labels at the very end
+    items = []
+    for offset, size, is_code, line_num in asm.items:
+        item = Item(asm.code[offset : offset + size], is_code, line_num)
+        item.labels = labels.pop(offset, [])
+        for i in range(size):
+            if offset + i in fixups:
+                item.fixups[i] = fixups[offset + i]
+            if offset + i in asm.comments:
+                item.comments[i] = asm.comments[offset + i]
+        items.append(item)
+
+    end = Item(bytearray(), False, None)
+    end.labels = [label for offset in sorted(labels) for label in labels[offset]]
+    items.append(end)
+
+    size = len(asm.code)
+    instructions = sum(item.is_code for item in items)
+    rewrites = []
+
+    def remove(i, why):
+        # Labels on a removed item now point at whatever follows it
+        rewrites.append(f"line {items[i].line_num}: {why}")
+        items[i + 1].labels[:0] = items[i].labels
+        del items[i]
+
+    def delta(item):
+        """(register, amount) for INC, DEC and ADDI with a number, else None"""
+        if not item.is_code or item.fixups:
+            return None
+        op = item.data[0]
+        if op == OPCODE_BYTES["INC"]:
+            return item.data[1], 1
+        if op == OPCODE_BYTES["DEC"]:
+            return item.data[1], 0xFF
+        if op == OPCODE_BYTES["ADDI"]:
+            return item.data[1], item.data[2]
+        return None
+
+    changed = True
+    while changed:
+        changed = False
+        i = 0
+
+        while i < len(items) - 1:
+            item, following = items[i], items[i + 1]
+
+            if not item.is_code:
+                i += 1
+                continue
+
+            op = item.data[0]
+
+            if op == OPCODE_BYTES["NOP"]:
+                remove(i, "dropped NOP")
+                changed = True
+                continue
+
+            if op in NO_FALLTHROUGH and following.is_code and not following.labels:
+                remove(i + 1, "dropped unreachable code")
+                changed = True
+                continue
+
+            step = delta(item)
+            if step is not None and step[1] == 0:
+                remove(i, f"dropped ADDI R{step[0]},0")
+                changed = True
+                continue
+
+            # Everything below merges item with the next instruction, which
+            # mustn't be a jump target
+            following_step = delta(following)
+            if following.labels or following_step is None:
+                i += 1
+                continue
+
+            reg, amount = following_step
+
+            if op == OPCODE_BYTES["LDI"] and item.data[1] == reg and not item.fixups:
+                item.data[2] = (item.data[2] + amount) & 0xFF
+                item.comments = {0: f"LDI R{reg},{item.data[2]}"}
+                remove(i + 1, f"folded into LDI R{reg},{item.data[2]}")
+                changed = True
+                continue
+
+            if step is not None and step[0] == reg:
+                total = (step[1] + amount) & 0xFF
+                item.data = bytearray((OPCODE_BYTES["ADDI"], reg, total))
+                item.comments = {0: f"ADDI R{reg},{total}"}
+                remove(i + 1, f"merged into ADDI R{reg},{total}")
+                changed = True
+                continue
+
+            i += 1
+
+    # Lay the code out again
+    asm.code = bytearray()
+    asm.sym = {}
+    asm.fixups = []
+    asm.comments = {}
+    asm.labels = []
+    asm.items = []
+
+    for item in items:
+        offset = len(asm.code)
+
+        for label in item.labels:
+            asm.sym[label] = offset
+            asm.labels.append((offset, label))
+        for i, (s, line_num) in item.fixups.items():
+            asm.fixups.append((offset + i, s, line_num))
+        for i, comment in item.comments.items():
+            asm.comments[offset + i] = comment
+
+        if item.data:
+            asm.items.append((offset, len(item.data), item.is_code, item.line_num))
+        asm.code += item.data
+
+    return {
+        "bytes": size - len(asm.code),
+        "cycles": instructions - sum(item.is_code for item in items),
+        "rewrites": rewrites,
+    }
+
+
+def pass2(asm):
     """
+    Pass 2
 
-    for c in code:
-        # Replace symbols
-        if c[:4] == 'sym:':
-            s = c[4:].strip()
+    Fill in every symbol reference recorded by pass 1.
+    """
 
-            if s in sym:
-                c = p8(sym[s])
+    for offset, s, line_num in asm.fixups:
+        if s not in asm.sym:
+            raise AssemblyError(f"unknown symbol: {s}", 2)
 
-            else:
-                print(f"unknown symbol: {s}", file=sys.stderr)
-                sys.exit(2)
+        asm.code[offset] = asm.sym[s] & 0xFF
 
-        outputfile.write(f"{c}\n")
+
+def assemble(source, optimize=False):
+    """
+    Assembles source (a string or an iterable of lines) into machine code bytes
+
+    optimize runs the peephole pass
+    """
+
+    if isinstance(source, str):
+        source = source.splitlines()
+
+    asm = Assembly()
+    pass1(source, asm)
+    if optimize:
+        peephole(asm)
+    pass2(asm)
+
+    return bytes(asm.code)
+
+
+def write_ls8(outputfile, asm):
+    """
+    Writes assembled code as a text .ls8 program, one commented byte per line
+    """
+
+    labels = iter(asm.labels + [(len(asm.code) + 1, None)])
+    next_label = next(labels)
+
+    for offset, value in enumerate(asm.code):
+        while next_label[0] <= offset:
+            outputfile.write(f"# {next_label[1]} (address {next_label[0]}):\n")
+            next_label = next(labels)
+
+        comment = asm.comments.get(offset)
+        outputfile.write(f"{p8(value)} # {comment}\n" if comment is not None else f"{p8(value)}\n")
+
+    # Labels after the last byte
+    while next_label[1] is not None:
+        outputfile.write(f"# {next_label[1]} (address {next_label[0]}):\n")
+        next_label = next(labels)
 
 
 def main(argv):
+    # -O turns on the peephole pass
+    optimize = "-O" in argv
+    argv = [arg for arg in argv if arg != "-O"]
+
     # Parse command line
     inputfile, outputfile = parse_commandline(argv)
 
     # Open files
     inputfile, outputfile = open_files(inputfile, outputfile)
 
-    # Set up the symbol table
-    sym = {}
-
-    # Set up the machine code output
-    code = []
-
     # Assemble
-    pass1(inputfile, sym, code)
-    pass2(outputfile, sym, code)
+    asm = Assembly()
+
+    try:
+        pass1(inputfile, asm)
+
+        if optimize:
+            report = peephole(asm)
+            print(
+                f"peephole: {report['bytes']} bytes, {report['cycles']} cycles saved",
+                file=sys.stderr,
+            )
+            for rewrite in report["rewrites"]:
+                print(f"  {rewrite}", file=sys.stderr)
+
+        pass2(asm)
+    except AssemblyError as error:
+        print(error, file=sys.stderr)
+        return error.status
+
+    write_ls8(outputfile, asm)
 
     return 0
 
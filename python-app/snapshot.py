@@ -0,0 +1,83 @@
+"""
+Snapshot ring
+
+Keeps the last few CPU snapshots, taken every interval cycles, so a run can be
+rewound while debugging.
+
+Attach the ring to the CPU and it is polled between batches of instructions
+like any other peripheral, so snapshots land on the first batch boundary after
+each interval.
+"""
+
+import io
+from collections import deque
+
+from output import OutputDevice
+
+# Cycles between snapshots
+SNAPSHOT_INTERVAL = 4096
+
+# Snapshots kept, older ones are dropped
+SNAPSHOT_CAPACITY = 64
+
+
+class SnapshotRing:
+    def __init__(self, ls8, interval=SNAPSHOT_INTERVAL, capacity=SNAPSHOT_CAPACITY):
+        self.ls8 = ls8
+        self.interval = interval
+        # (cycles, snapshot) pairs, oldest first
+        self.snapshots = deque(maxlen=capacity)
+        self._next = ls8.cycles
+
+    def poll(self):
+        """
+        Takes a snapshot if one is due
+        """
+        if self.ls8.cycles >= self._next:
+            self.take()
+
+    def take(self):
+        """
+        Snapshots the CPU now
+        """
+        cycles = self.ls8.cycles
+        self.snapshots.append((cycles, self.ls8.snapshot()))
+        self._next = cycles + self.interval
+
+    def rewind(self, cycles):
+        """
+        Winds the CPU back by cycles cycles
+
+        Restores the newest snapshot at or before the target and replays the
+        remaining cycles unthrottled, without idle loop handling, with output
+        discarded and other peripherals detached. Snapshots newer than the
+        target are dropped. Returns the cycle count the CPU was rewound to.
+
+        The replay is exact with the virtual timer (timer_cycles), the wall
+        clock timer fires whenever a second has passed.
+        """
+        ls8 = self.ls8
+        target = max(0, ls8.cycles - cycles)
+
+        while self.snapshots and self.snapshots[-1][0] > target:
+            self.snapshots.pop()
+
+        if not self.snapshots:
+            raise ValueError("no snapshot that far back")
+
+        taken, snapshot = self.snapshots[-1]
+        ls8.restore(snapshot)
+        self._next = taken + self.interval
+
+        if target > taken:
+            output, devices = ls8.output, ls8.devices
+            clock_hz, idle = ls8.clock_hz, ls8.idle
+            ls8.output, ls8.devices = OutputDevice(io.BytesIO()), [self]
+            ls8.clock_hz, ls8.idle = None, False
+            try:
+                ls8.run(max_cycles=target - taken)
+            finally:
+                ls8.output, ls8.devices = output, devices
+                ls8.clock_hz, ls8.idle = clock_hz, idle
+
+        return ls8.cycles
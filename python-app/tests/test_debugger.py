@@ -0,0 +1,42 @@
+"""
+Breakpoints and watchpoints
+
+Run from python-app: python -m pytest tests
+"""
+
+import io
+import unittest
+
+from cpu import CPU, EXIT_BREAK
+from debugger import Debugger
+from output import OutputDevice
+
+# LDI R5,1 (IM = timer) / LDI R0,loop / loop: JMP R0
+# Timer handler at 0x20: INC R1 / IRET
+WAIT_FOR_TIMER = bytes.fromhex("820501820006" "5400")
+HANDLER = bytes.fromhex("6501" "13")
+
+
+class InterruptWatchpoint(unittest.TestCase):
+    def test_stops_before_the_handler_runs(self):
+        cpu = CPU(clock_hz=None, timer_cycles=10, output=OutputDevice(io.BytesIO()))
+        cpu.load_bytes(WAIT_FOR_TIMER)
+        cpu.ram[0x20 : 0x20 + len(HANDLER)] = HANDLER
+        cpu.ram[0xF8] = 0x20
+
+        debugger = Debugger(cpu)
+        debugger.attach()
+        # Where the interrupt pushes the return address
+        debugger.watch_memory(0xF3)
+
+        result = cpu.run(max_cycles=100)
+
+        self.assertEqual(result.reason, EXIT_BREAK)
+        self.assertEqual(result.fault, "write of 0x06 to 0xF3")
+        self.assertEqual(result.cycles, 10)
+        self.assertEqual(cpu.pc, 0x20)
+        self.assertEqual(cpu.reg[1], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+"""
+Program image cache
+
+Run from python-app: python -m pytest tests
+"""
+
+import os
+import tempfile
+import unittest
+
+import image
+
+# LDI R0,8 / PRN R0 / HLT
+PROGRAM = "10000010\n00000000\n00001000\n01000111\n00000000\n00000001\n"
+
+
+class StaleImage(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        self.source = os.path.join(directory.name, "print8.ls8")
+        with open(self.source, "w") as source_file:
+            source_file.write(PROGRAM)
+        self.image_file = image.cached_image_path(self.source)
+
+    def write_cached(self, data):
+        with open(self.image_file, "wb") as image_file:
+            image_file.write(data)
+
+        # Newer than the source, so it looks fresh
+        source_time = os.stat(self.source).st_mtime_ns
+        os.utime(self.image_file, ns=(source_time + 10**9, source_time + 10**9))
+
+    def assert_rebuilt(self):
+        memory = bytearray(256)
+
+        self.assertEqual(image.load_program(self.source, memory), (0, 0, 6))
+        self.assertEqual(memory[:6], bytes.fromhex("820008470001"))
+        self.assertTrue(image.is_image(self.image_file))
+
+    def test_other_version_is_rebuilt(self):
+        self.write_cached(
+            image.HEADER.pack(image.MAGIC, image.VERSION + 1, 0, 0) + bytes(6)
+        )
+        self.assert_rebuilt()
+
+    def test_damaged_image_is_rebuilt(self):
+        self.write_cached(b"LS8")
+        self.assert_rebuilt()
+
+
+if __name__ == "__main__":
+    unittest.main()
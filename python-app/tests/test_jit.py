@@ -0,0 +1,54 @@
+"""
+JIT tier against the interpreter
+
+Run from python-app: python -m pytest tests
+"""
+
+import io
+import unittest
+
+from cpu import CPU, EXIT_FAULT
+from output import OutputDevice
+
+
+def run(program, jit, max_cycles=100_000, **kwargs):
+    """
+    Runs program on a fresh unthrottled CPU, returns (RunResult, CPU)
+    """
+    cpu = CPU(clock_hz=None, jit=jit, output=OutputDevice(io.BytesIO()), **kwargs)
+    cpu.load_bytes(program)
+    return cpu.run(max_cycles=max_cycles), cpu
+
+
+class RunOffEndOfRAM(unittest.TestCase):
+    def test_faults_like_the_interpreter(self):
+        # 256 NOPs, PC runs past 0xFF
+        interpreted, _ = run(bytes(256), jit=False)
+        compiled, _ = run(bytes(256), jit=True)
+
+        self.assertEqual(compiled.reason, EXIT_FAULT)
+        self.assertEqual(compiled.fault, interpreted.fault)
+        self.assertEqual(compiled.cycles, interpreted.cycles)
+
+
+class MachineState(unittest.TestCase):
+    def test_blocks_leave_ir_like_the_interpreter(self):
+        # LDI R0,0 / LDI R1,1 / loop: ADD R0,R1 / LDI R2,loop / JMP R2
+        program = bytes.fromhex("820000820101a00001820206" "5402")
+
+        # Warm up until the loop is compiled, stopping at its start
+        _, slow = run(program, jit=False, max_cycles=2 + 3 * 20)
+        _, fast = run(program, jit=True, max_cycles=2 + 3 * 20)
+        self.assertIn(6, fast._jit_blocks)
+
+        # One more pass, run by the compiled block
+        for cpu in (slow, fast):
+            cpu.ir = 0
+            cpu.run(max_cycles=3)
+
+        self.assertEqual((fast.pc, fast.ir), (slow.pc, slow.ir))
+        self.assertEqual(fast.reg, slow.reg)
+
+
+if __name__ == "__main__":
+    unittest.main()
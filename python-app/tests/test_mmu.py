@@ -0,0 +1,119 @@
+"""
+Bank switching through the MMU
+
+Run from python-app: python -m pytest tests
+"""
+
+import io
+import os
+import tempfile
+import unittest
+
+from cpu import CPU, EXIT_BREAK, EXIT_FAULT, EXIT_HALT
+from debugger import Debugger
+from mmu import MMU, WINDOW_SIZE
+from output import OutputDevice
+
+# LDI R0,0xF5 / LDI R1,0 / LDI R2,1
+# loop: ADD R1,R2 / ST R0,R1 / LDI R3,loop / JMP R3
+SELECT_EVERY_BANK = bytes.fromhex("8200f5820100820201" "a00102840001820309" "5403")
+
+# LDI R0,0xF5 / LDI R1,2 / ST R0,R1 (bank 2)
+# LDI R2,0x80 / LDI R3,0xAB / ST R2,R3
+# LDI R1,3 / ST R0,R1 (bank 3)
+# LDI R2,0x81 / LDI R3,0xCD / ST R2,R3
+# LDI R1,2 / ST R0,R1 (bank 2)
+# LDI R2,0x80 / LD R4,R2 / HLT
+ROUND_TRIP = bytes.fromhex(
+    "8200f5820102840001"
+    "8202808203ab840203"
+    "820103840001"
+    "8202818203cd840203"
+    "820102840001"
+    "820280830402" "01"
+)
+
+
+class BankFileTestCase(unittest.TestCase):
+    def setUp(self):
+        handle, self.bank_file = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, self.bank_file)
+
+    def run_program(self, program, jit):
+        cpu = CPU(clock_hz=None, jit=jit, output=OutputDevice(io.BytesIO()))
+        mmu = MMU(cpu, self.bank_file, banks=16)
+        self.addCleanup(mmu.close)
+        mmu.attach()
+        cpu.load_bytes(program)
+
+        return cpu.run(max_cycles=10_000), cpu, mmu
+
+
+class BankOutOfRange(BankFileTestCase):
+    def test_faults_on_the_store(self):
+        result, cpu, mmu = self.run_program(SELECT_EVERY_BANK, jit=False)
+
+        self.assertEqual(result.reason, EXIT_FAULT)
+        self.assertEqual(cpu.pc, 12)
+        self.assertEqual(cpu.reg[1], 16)
+
+        # The bank select register still names the bank that is mapped in
+        self.assertEqual(cpu.ram[0xF5], 15)
+        mmu.sync()
+        self.assertEqual(mmu.bank, 15)
+
+    def test_compiled_blocks_fault_like_the_interpreter(self):
+        interpreted, slow, _ = self.run_program(SELECT_EVERY_BANK, jit=False)
+        compiled, fast, _ = self.run_program(SELECT_EVERY_BANK, jit=True)
+
+        self.assertTrue(fast._jit_blocks)
+        self.assertEqual(compiled.reason, EXIT_FAULT)
+        self.assertEqual(compiled.fault, interpreted.fault)
+        self.assertEqual(compiled.cycles, interpreted.cycles)
+        self.assertEqual((fast.pc, fast.ir), (slow.pc, slow.ir))
+        self.assertEqual(fast.reg, slow.reg)
+
+
+class RoundTrip(BankFileTestCase):
+    def test_writes_reach_the_file(self):
+        result, cpu, mmu = self.run_program(ROUND_TRIP, jit=False)
+
+        self.assertEqual(result.reason, EXIT_HALT)
+        # Switching away and back brings the bank's contents back
+        self.assertEqual(cpu.reg[4], 0xAB)
+        self.assertEqual(mmu.bank, 2)
+
+        mmu.sync()
+        mmu.close()
+        with open(self.bank_file, "rb") as bank_file:
+            data = bank_file.read()
+
+        self.assertEqual(len(data), 16 * WINDOW_SIZE)
+        self.assertEqual(data[2 * WINDOW_SIZE], 0xAB)
+        self.assertEqual(data[3 * WINDOW_SIZE + 1], 0xCD)
+        self.assertEqual(data.count(0), len(data) - 2)
+
+    def test_debugger_watches_the_window(self):
+        cpu = CPU(clock_hz=None, output=OutputDevice(io.BytesIO()))
+        mmu = MMU(cpu, self.bank_file, banks=16)
+        self.addCleanup(mmu.close)
+        mmu.attach()
+        debugger = Debugger(cpu)
+        debugger.attach()
+        debugger.watch_memory(0x80)
+        cpu.load_bytes(ROUND_TRIP)
+
+        result = cpu.run(max_cycles=10_000)
+        self.assertEqual(result.reason, EXIT_BREAK)
+        self.assertEqual(result.fault, "write of 0xAB to 0x80")
+
+        # Detaching the debugger leaves the MMU hooked
+        debugger.detach()
+        self.assertEqual(cpu.run(max_cycles=10_000).reason, EXIT_HALT)
+        self.assertEqual(cpu.reg[4], 0xAB)
+        self.assertEqual(mmu.memory[2 * WINDOW_SIZE], 0xAB)
+
+
+if __name__ == "__main__":
+    unittest.main()
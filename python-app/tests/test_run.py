@@ -0,0 +1,71 @@
+"""
+Run results for programs that go wrong
+
+Run from python-app: python -m pytest tests
+"""
+
+import importlib.util
+import io
+import unittest
+
+from cpu import CPU, EXIT_FAULT
+from output import OutputDevice
+
+# LDI R5,1 (IM = timer) then NOPs up to the end of RAM
+RUN_OFF_END_WITH_TIMER = bytes([0x82, 5, 1]) + bytes(253)
+
+
+class InterruptPastEndOfRAM(unittest.TestCase):
+    def run_program(self, jit):
+        cpu = CPU(
+            clock_hz=None, jit=jit, timer_cycles=254, output=OutputDevice(io.BytesIO())
+        )
+        cpu.load_bytes(RUN_OFF_END_WITH_TIMER)
+        return cpu.run(max_cycles=1000)
+
+    def test_faults_instead_of_raising(self):
+        result = self.run_program(jit=False)
+
+        self.assertEqual(result.reason, EXIT_FAULT)
+        self.assertEqual(result.cycles, 255)
+
+    def test_compiled_blocks_fault_like_the_interpreter(self):
+        interpreted = self.run_program(jit=False)
+        compiled = self.run_program(jit=True)
+
+        self.assertEqual(compiled.reason, EXIT_FAULT)
+        self.assertEqual(compiled.fault, interpreted.fault)
+        self.assertEqual(compiled.cycles, interpreted.cycles)
+
+    @unittest.skipUnless(importlib.util.find_spec("numpy"), "lockstep needs numpy")
+    def test_lockstep_faults_like_the_interpreter(self):
+        from lockstep import LockstepCPU
+
+        interpreted = self.run_program(jit=False)
+
+        machines = LockstepCPU(1, timer_cycles=254)
+        machines.ram[0, : len(RUN_OFF_END_WITH_TIMER)] = list(RUN_OFF_END_WITH_TIMER)
+        machines.run(max_cycles=1000)
+
+        self.assertEqual(machines.exit_reason(0), EXIT_FAULT)
+        self.assertEqual(machines.cycles[0], interpreted.cycles)
+        self.assertEqual(machines.pc[0], interpreted.state["pc"])
+
+
+class FaultInIdleLoop(unittest.TestCase):
+    def test_counts_the_faulting_instruction_once(self):
+        # LDI R0,0 / LDI R2,9 / DIV R1,R0 / JMP R2
+        program = bytes.fromhex("820000820209a301005402")
+
+        for clock_hz in (200, None):
+            for idle in (True, False):
+                cpu = CPU(clock_hz=clock_hz, idle=idle, output=OutputDevice(io.BytesIO()))
+                cpu.load_bytes(program)
+                result = cpu.run(max_cycles=100)
+
+                self.assertEqual(result.reason, EXIT_FAULT)
+                self.assertEqual(result.cycles, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
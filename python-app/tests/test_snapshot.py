@@ -0,0 +1,59 @@
+"""
+Snapshot ring rewind
+
+Run from python-app: python -m pytest tests
+"""
+
+import io
+import time
+import unittest
+
+from cpu import CPU
+from output import OutputDevice
+from snapshot import SnapshotRing
+
+
+def new_cpu(**kwargs):
+    cpu = CPU(timer_cycles=300, output=OutputDevice(io.BytesIO()), **kwargs)
+    cpu.load("programs/interrupts.ls8")
+    return cpu
+
+
+class Rewind(unittest.TestCase):
+    def test_replays_unthrottled_to_the_same_state(self):
+        expected = new_cpu(clock_hz=None)
+        expected.run(max_cycles=2000)
+
+        cpu = new_cpu(clock_hz=None)
+        ring = SnapshotRing(cpu, interval=500)
+        cpu.attach(ring)
+        cpu.run(max_cycles=2400)
+
+        # Replaying 400 cycles at 100 Hz would take 4 seconds
+        cpu.clock_hz = 100
+        start = time.perf_counter()
+        self.assertEqual(ring.rewind(400), 2000)
+        self.assertLess(time.perf_counter() - start, 1)
+
+        self.assertEqual(cpu.state(), expected.state())
+        self.assertEqual(cpu.ram, expected.ram)
+        self.assertEqual((cpu.clock_hz, cpu.idle), (100, True))
+
+
+class Restore(unittest.TestCase):
+    def test_wall_clock_snapshot_rearms_the_virtual_timer(self):
+        source = CPU(clock_hz=None, output=OutputDevice(io.BytesIO()))
+        source.load("programs/interrupts.ls8")
+        source.run(max_cycles=100)
+
+        cpu = new_cpu(clock_hz=None)
+        cpu.restore(source.snapshot())
+        result = cpu.run(max_cycles=1000)
+
+        # Timer periods of 300 cycles from the restored cycle count
+        self.assertEqual(result.cycles, 1000)
+        self.assertEqual(cpu._next_timer, 100 + 4 * 300)
+
+
+if __name__ == "__main__":
+    unittest.main()
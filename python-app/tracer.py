@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+
+"""
+Instruction trace
+
+While tracing, the CPU writes one fixed size binary record per instruction
+into a ring buffer instead of printing it. Only the most recent records are
+kept, unless the trace is backed by a file, in which case the buffer is
+written out every time it fills up.
+
+Record layout (little endian, 20 bytes):
+    4 bytes  cycle (low 32 bits)
+    1 byte   PC
+    1 byte   IR
+    2 bytes  the two bytes following the instruction (operands)
+    8 bytes  R0-R7
+    1 byte   FL
+    3 bytes  padding
+
+Trace files start with a header ("LS8T", version, record size) followed by
+the records.
+
+Run as a script to decode a trace file:
+
+    python tracer.py trace.ls8t
+    python tracer.py trace.ls8t --start 0x10 --end 0x20
+    python tracer.py trace.ls8t --diff other.ls8t
+"""
+
+import argparse
+import struct
+import sys
+
+MAGIC = b"LS8T"
+VERSION = 1
+
+HEADER = struct.Struct("<4sBB2x")
+RECORD = struct.Struct("<IBBBB8sB3x")
+
+# Records kept in memory by default
+TRACE_CAPACITY = 65536
+
+
+class TraceBuffer:
+    def __init__(self, capacity=TRACE_CAPACITY, trace_file=None):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * RECORD.size)
+        # Records written in total, and how many of those are in trace_file
+        self.count = 0
+        self._saved = 0
+
+        # Binary file every record ends up in, None keeps just the ring
+        self.trace_file = trace_file
+        if trace_file is not None:
+            trace_file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+
+    def record(self, cpu, cycle):
+        """
+        Records the instruction at PC, before it executes
+        """
+        pc = cpu.pc
+        ram = cpu.ram
+        index = self.count % self.capacity
+
+        RECORD.pack_into(
+            self.buffer,
+            index * RECORD.size,
+            cycle & 0xFFFFFFFF,
+            pc,
+            ram[pc],
+            ram[(pc + 1) & 0xFF],
+            ram[(pc + 2) & 0xFF],
+            cpu.reg,
+            cpu.fl,
+        )
+        self.count += 1
+
+        # Write the ring out before it wraps around
+        if self.trace_file is not None and index == self.capacity - 1:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes records not yet in the trace file to it
+        """
+        if self.trace_file is None:
+            return
+
+        start = self._saved % self.capacity
+        end = start + self.count - self._saved
+
+        if end > self.capacity:
+            self.trace_file.write(self.buffer[start * RECORD.size :])
+            end -= self.capacity
+            start = 0
+        self.trace_file.write(self.buffer[start * RECORD.size : end * RECORD.size])
+
+        self._saved = self.count
+
+    def records(self):
+        """
+        Returns the records still in the ring, oldest first
+        """
+        kept = min(self.count, self.capacity)
+        start = (self.count - kept) % self.capacity
+        data = self.buffer[start * RECORD.size :] + self.buffer[: start * RECORD.size]
+
+        return list(RECORD.iter_unpack(data[: kept * RECORD.size]))
+
+    def save(self, output_file):
+        """
+        Writes the records still in the ring to a trace file
+        """
+        with open(output_file, "wb") as trace_file:
+            trace_file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+            for record in self.records():
+                trace_file.write(RECORD.pack(*record))
+
+
+def read_trace(input_file):
+    """
+    Reads every record from a trace file
+    """
+    with open(input_file, "rb") as trace_file:
+        data = trace_file.read()
+
+    if len(data) < HEADER.size:
+        raise ValueError(f"{input_file}: truncated trace header")
+
+    magic, version, record_size = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+        raise ValueError(f"{input_file}: not an LS-8 trace")
+
+    body = data[HEADER.size :]
+    body = body[: len(body) - len(body) % RECORD.size]
+
+    return list(RECORD.iter_unpack(body))
+
+
+def in_range(records, start=0, end=0xFF):
+    """
+    Yields the records whose PC lies between start and end, inclusive
+    """
+    for record in records:
+        if start <= record[1] <= end:
+            yield record
+
+
+def format_record(record):
+    """
+    Renders a record like CPU._trace, prefixed with the cycle and followed by FL
+    """
+    cycle, pc, ir, a, b, reg, fl = record
+    registers = " ".join("%02X" % value for value in reg)
+
+    return f"{cycle:>10} TRACE: {pc:02X} | {ir:02X} {a:02X} {b:02X} | {registers} | {fl:02X}"
+
+
+def diff(first, second):
+    """
+    Compares two traces, ignoring cycle numbers
+
+    Returns the index of the first record that differs, None if the traces
+    are identical.
+    """
+    for index, (a, b) in enumerate(zip(first, second)):
+        if a[1:] != b[1:]:
+            return index
+
+    if len(first) != len(second):
+        return min(len(first), len(second))
+
+    return None
+
+
+def parse_args():
+    """
+    Parses command line arguments
+    """
+    parser = argparse.ArgumentParser(prog="tracer.py", description="LS-8 trace decoder")
+    parser.add_argument("trace", help="trace file")
+    parser.add_argument(
+        "--start", type=lambda value: int(value, 0), default=0, help="lowest PC to show"
+    )
+    parser.add_argument(
+        "--end", type=lambda value: int(value, 0), default=0xFF, help="highest PC to show"
+    )
+    parser.add_argument("-n", "--last", type=int, metavar="N", help="only show the last N records")
+    parser.add_argument("--diff", metavar="OTHER", help="show where OTHER diverges from trace")
+    parser.add_argument(
+        "--context", type=int, default=5, metavar="N", help="records shown around a difference"
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    try:
+        records = list(in_range(read_trace(args.trace), args.start, args.end))
+
+        if args.diff:
+            other = list(in_range(read_trace(args.diff), args.start, args.end))
+    except (OSError, ValueError) as error:
+        print(error, file=sys.stderr)
+        sys.exit(2)
+
+    if args.diff:
+        index = diff(records, other)
+        if index is None:
+            print(f"traces match ({len(records)} records)")
+            sys.exit(0)
+
+        print(f"traces diverge at record {index}")
+        for label, trace in ((args.trace, records), (args.diff, other)):
+            print(f"--- {label}")
+            for record in trace[max(0, index - args.context) : index + args.context + 1]:
+                print(format_record(record))
+        sys.exit(1)
+
+    if args.last is not None:
+        records = records[max(0, len(records) - args.last) :]
+
+    for record in records:
+        print(format_record(record))